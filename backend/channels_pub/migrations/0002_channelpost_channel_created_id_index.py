@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels_pub', '0001_initial'),
+    ]
+
+    operations = [
+        # (channel, -created_at, -id): stesso verso del cursore, niente filesort sul tie-break
+        migrations.AddIndex(
+            model_name='channelpost',
+            index=models.Index(fields=['channel', '-created_at', '-id'], name='channel_po_chan_created_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='channelpost',
+            name='channel_po_channel_idx',
+        ),
+    ]
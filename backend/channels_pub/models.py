@@ -176,7 +176,7 @@ class ChannelPost(models.Model):
         db_table = 'channel_posts'
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['channel', '-created_at']),
+            models.Index(fields=['channel', '-created_at', '-id'], name='channel_po_chan_created_idx'),
             models.Index(fields=['channel', 'is_pinned']),
             models.Index(fields=['is_scheduled', 'scheduled_at']),
             models.Index(fields=['is_published']),
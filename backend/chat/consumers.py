@@ -161,8 +161,8 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             'message': safe_message_data,
             'sender_id': self.user.id,
         })
-        t1 = _time.time()
-        print(f'[PERF] group_send took {(t1-t0)*1000:.1f}ms sender={self.user.email}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('[PERF] group_send took %.1fms sender=%s', (_time.time() - t0) * 1000, self.user.id)
         
         # Send push notifications to offline participants
         await self._notify_offline_participants(conversation_id, message_data)
@@ -286,7 +286,7 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                 'sender_id': self.user.id,
             })
         except Exception as e:
-            print(f'[CONSUMER] attachment_ready error: {e}')
+            logger.error('[CONSUMER] attachment_ready error: %s', e)
 
     async def _handle_reaction(self, data):
         """Add or remove a reaction"""
@@ -314,13 +314,19 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         # Don't send own messages back
         if event.get('sender_id') == self.user.id:
             return
+        message = event['message']
+        if 'content_encrypted_for_user' in event:
+            # Fan-out E2E gruppi: payload condiviso + payload cifrato per questo utente
+            message = {**message, 'content_encrypted': event['content_encrypted_for_user']}
         await self.send_json({
             'type': 'chat.message',
-            'message': event['message'],
+            'message': message,
         })
-        t_sent = _time.time()
-        msg_id = event['message'].get('id', '?')[:8]
-        print(f'[PERF] chat_message forwarded to {self.user.email} in {(t_sent-t_recv)*1000:.1f}ms msg={msg_id}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                '[PERF] chat_message forwarded to user=%s in %.1fms msg=%s',
+                self.user.id, (_time.time() - t_recv) * 1000, event['message'].get('id', '?')[:8],
+            )
 
     async def typing_indicator(self, event):
         """Forward typing indicator (including is_recording for voice)"""
@@ -0,0 +1,56 @@
+"""
+Path converter per le URL chat.
+"""
+import functools
+import uuid
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_uuid(value):
+    return uuid.UUID(value)
+
+
+class FastUUIDConverter:
+    """
+    Come il converter 'uuid' di Django, ma con regex precompilata e
+    parsing memoizzato: conversation_id si ripete su messages/read/mute/...
+    quindi uuid.UUID() viene costruito una sola volta per id.
+    """
+    regex = '[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+
+    def to_python(self, value):
+        return _parse_uuid(value)
+
+    def to_url(self, value):
+        return str(value)
+
+
+class SafeMediaPathConverter:
+    """
+    Path relativo dentro MEDIA_ROOT: niente segmenti vuoti (quindi niente '/'
+    iniziale), null byte o '..'. Un path non valido non matcha la route e
+    la view non deve ripetere il controllo.
+    """
+    regex = r'[^/\x00]+(?:/[^/\x00]+)*'
+
+    def to_python(self, value):
+        if '..' in value:
+            raise ValueError('path traversal')
+        return value
+
+    def to_url(self, value):
+        return value
+
+
+class InviteCodeConverter:
+    """
+    Codice invito gruppo: 12 caratteri esadecimali (Group.new_invite_code).
+    Lunghezza fissa, nessun backtracking.
+    """
+    regex = '[0-9a-f]{12}'
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return value
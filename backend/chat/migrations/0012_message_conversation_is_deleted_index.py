@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-17 05:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_alter_conversationparticipant_role'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'is_deleted', 'created_at'], name='messages_conv_del_created_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import secrets
 import uuid
 from django.db import models
 from django.conf import settings
@@ -121,6 +122,8 @@ class Message(models.Model):
         indexes = [
             models.Index(fields=['conversation', 'created_at']),
             models.Index(fields=['sender', 'created_at']),
+            # Ricerca e ultimo messaggio visibile: filtrano sempre is_deleted=False
+            models.Index(fields=['conversation', 'is_deleted', 'created_at'], name='messages_conv_del_created_idx'),
         ]
 
     def __str__(self):
@@ -293,6 +296,11 @@ class CalendarEvent(models.Model):
 
 
 class Group(models.Model):
+    INVITE_CODE_ATTEMPTS = 3
+    # v2: il valore in cache include anche il nome del gruppo
+    INVITE_CACHE = 'group-invite:v2:{}'
+    INVITE_CACHE_TTL = 24 * 3600
+
     conversation = models.OneToOneField(
         Conversation, on_delete=models.CASCADE, related_name='group_info'
     )
@@ -318,6 +326,14 @@ class Group(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Link come letto dal DB: chat.signals invalida quello vecchio senza rileggerlo
+        if 'invite_link' in instance.__dict__:
+            instance._loaded_invite_link = instance.invite_link
+        return instance
+
     def is_invite_valid(self):
         if not self.invite_link:
             return False
@@ -325,6 +341,34 @@ class Group(models.Model):
             return False
         return True
 
+    @staticmethod
+    def new_invite_code():
+        """
+        Codice invito: 12 caratteri esadecimali da 48 bit casuali (CSPRNG). Non
+        sequenziale, così i link dei gruppi non si possono enumerare.
+        """
+        return secrets.token_hex(6)
+
+    @classmethod
+    def get_invite_cached(cls, invite_code):
+        """
+        Dati del gruppo usati dal join via link (conversation_id, name,
+        max_members, invite_link_expires), in cache per un giorno: la scadenza del link è
+        controllata a ogni join sul valore in cache. None se il link non esiste;
+        i link inesistenti non vengono messi in cache. Aggiornato/invalidato da
+        chat.signals a ogni save/delete del gruppo.
+        """
+        from django.core.cache import cache
+        key = cls.INVITE_CACHE.format(invite_code)
+        info = cache.get(key)
+        if info is None:
+            info = cls.objects.filter(invite_link=invite_code).values(
+                'conversation_id', 'name', 'max_members', 'invite_link_expires',
+            ).first()
+            if info is not None:
+                cache.set(key, info, cls.INVITE_CACHE_TTL)
+        return info
+
 
 class Story(models.Model):
     STORY_TYPES = [('image', 'Image'), ('video', 'Video'), ('text', 'Text')]
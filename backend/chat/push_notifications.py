@@ -24,6 +24,10 @@ NOTIFY_SERVICE_KEY = os.getenv("NOTIFY_SERVICE_KEY", "").strip()
 # Timeout HTTP verso il notify server
 NOTIFY_TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT", "10"))
 
+# Connessione keep-alive verso il notify server: il fan-out di un messaggio di
+# gruppo riusa lo stesso socket invece di un handshake TCP per destinatario
+_notify_session = requests.Session()
+
 
 def _notify_headers() -> Dict[str, str]:
     """Restituisce gli header per le chiamate al notify server."""
@@ -78,7 +82,7 @@ def send_push_notification(
         payload["encrypted_payload"] = encrypted_payload
 
     try:
-        response = requests.post(
+        response = _notify_session.post(
             f"{NOTIFY_BASE_URL}/send",
             json=payload,
             headers=_notify_headers(),
@@ -263,7 +267,7 @@ def register_device(
         payload["device_id"] = device_id
 
     try:
-        response = requests.post(
+        response = _notify_session.post(
             f"{NOTIFY_BASE_URL}/register",
             json=payload,
             headers=_notify_headers(),
@@ -301,7 +305,7 @@ def unregister_device(
         payload["fcm_token"] = fcm_token
 
     try:
-        response = requests.post(
+        response = _notify_session.post(
             f"{NOTIFY_BASE_URL}/unregister",
             json=payload,
             headers=_notify_headers(),
@@ -326,10 +330,11 @@ def send_push_to_conversation_participants(conversation, sender, title, body, da
     eccetto il mittente.
     """
     try:
-        participants = conversation.participants.exclude(id=sender.id)
-        for user in participants:
+        # Solo gli id: titolo e corpo arrivano già calcolati dal chiamante
+        recipient_ids = conversation.participants.exclude(id=sender.id).values_list('id', flat=True)
+        for user_id in recipient_ids:
             send_push_notification(
-                user_id=user.id,
+                user_id=user_id,
                 title=title,
                 body=body,
                 data=data or {},
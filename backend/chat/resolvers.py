@@ -0,0 +1,90 @@
+"""
+URL resolver per le API chat.
+
+PrefixIndexedResolver indicizza i pattern per primo segmento letterale
+(es. 'conversations', 'stories', 'groups') così che resolve() provi solo
+i pattern del bucket corrispondente invece di scorrere tutta la lista.
+"""
+from django.urls import URLResolver, get_resolver
+from django.urls.resolvers import RoutePattern
+
+
+def _literal_head(pattern):
+    """
+    Primo segmento letterale di una route, oppure None se la route può
+    matchare path con qualunque prefisso (include vuoto, converter iniziale,
+    re_path).
+    """
+    if not isinstance(pattern, RoutePattern):
+        return None
+    route = str(pattern._route)
+    literal = route.split('<', 1)[0]
+    if '/' in literal:
+        return literal.split('/', 1)[0]
+    if literal == route and pattern._is_endpoint:
+        return route
+    return None
+
+
+class PrefixIndexedResolver(URLResolver):
+    """
+    URLResolver che risolve tramite un indice dict[primo_segmento, bucket].
+
+    Ogni bucket contiene, nell'ordine originale, i pattern con quel prefisso
+    letterale più i pattern "jolly" (senza prefisso letterale), quindi il
+    risultato è identico alla scansione lineare di Django. I path con un
+    primo segmento non indicizzato ricadono sulla risoluzione standard.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prefix_index = None
+
+    def _get_prefix_index(self):
+        if self._prefix_index is None:
+            entries = [(_literal_head(p.pattern), p) for p in self.url_patterns]
+            heads = dict.fromkeys(h for h, _ in entries if h is not None)
+            self._prefix_index = {
+                head: URLResolver(
+                    self.pattern,
+                    tuple(p for h, p in entries if h is None or h == head),
+                    self.default_kwargs,
+                    self.app_name,
+                    self.namespace,
+                )
+                for head in heads
+            }
+        return self._prefix_index
+
+    def resolve(self, path):
+        path = str(path)
+        match = self.pattern.match(path)
+        if match:
+            new_path = match[0]
+            bucket = self._get_prefix_index().get(new_path.split('/', 1)[0])
+            if bucket is not None:
+                return bucket.resolve(path)
+        return super().resolve(path)
+
+
+def indexed(urlpatterns):
+    """Monta una lista di pattern sotto un PrefixIndexedResolver con prefisso vuoto."""
+    return PrefixIndexedResolver(RoutePattern(''), urlpatterns)
+
+
+def warm_up(resolver=None):
+    """
+    Importa gli URLconf, compila le regex e popola reverse_dict e gli indici
+    per prefisso al boot del worker, invece che alla prima richiesta.
+    """
+    if resolver is None:
+        resolver = get_resolver()
+    resolver.reverse_dict
+    resolver.namespace_dict
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            if isinstance(pattern, PrefixIndexedResolver):
+                for bucket in pattern._get_prefix_index().values():
+                    warm_up(bucket)
+            warm_up(pattern)
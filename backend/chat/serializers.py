@@ -158,69 +158,64 @@ class ConversationListSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'created_by_id',
         ]
 
+    def _my_participant(self, obj):
+        """
+        Riga ConversationParticipant dell'utente corrente, cercata nella lista
+        conversation_participants (prefetch della view) e memorizzata sull'oggetto.
+        """
+        if not hasattr(obj, '_my_participant'):
+            request = self.context.get('request')
+            user = getattr(request, 'user', None)
+            obj._my_participant = next(
+                (p for p in obj.conversation_participants.all() if p.user_id == getattr(user, 'id', None)),
+                None,
+            )
+        return obj._my_participant
+
     def get_last_message(self, obj):
         request = self.context.get('request')
         user = request.user if request else None
         if user is None:
             return None
-        participant = obj.conversation_participants.filter(user=user).first()
-        cleared_at = participant.cleared_at if participant else None
-        qs = obj.messages.filter(is_deleted=False)
-        if cleared_at:
-            qs = qs.filter(created_at__gt=cleared_at)
-        last = qs.order_by('-created_at').first()
+        if hasattr(obj, 'last_visible_message'):
+            # Già caricato da ConversationListView (subquery + un solo fetch)
+            last = obj.last_visible_message
+        else:
+            participant = self._my_participant(obj)
+            cleared_at = participant.cleared_at if participant else None
+            qs = obj.messages.filter(is_deleted=False)
+            if cleared_at:
+                qs = qs.filter(created_at__gt=cleared_at)
+            last = qs.order_by('-created_at').first()
         if last is None:
             return None
         return MessageSerializer(last, context=self.context).data
 
     def get_participants_info(self, obj):
-        participants = obj.conversation_participants.select_related('user').all()
+        if 'conversation_participants' in getattr(obj, '_prefetched_objects_cache', {}):
+            participants = obj.conversation_participants.all()
+        else:
+            participants = obj.conversation_participants.select_related('user').all()
         return ParticipantSerializer(participants, many=True).data
 
     def get_unread_count(self, obj):
-        user = self.context.get('request', {})
-        if hasattr(user, 'user'):
-            user = user.user
-        try:
-            p = obj.conversation_participants.get(user=user)
-            return p.unread_count
-        except Exception:
-            return 0
+        p = self._my_participant(obj)
+        return p.unread_count if p else 0
 
     def get_is_pinned(self, obj):
-        user = self.context.get('request', {})
-        if hasattr(user, 'user'):
-            user = user.user
-        try:
-            p = obj.conversation_participants.get(user=user)
-            return p.is_pinned
-        except Exception:
-            return False
+        p = self._my_participant(obj)
+        return p.is_pinned if p else False
 
     def get_is_muted(self, obj):
         from django.utils import timezone
-        user = self.context.get('request', {})
-        if hasattr(user, 'user'):
-            user = user.user
-        try:
-            p = obj.conversation_participants.get(user=user)
-            return p.muted_until is not None and timezone.now() < p.muted_until
-        except Exception:
-            return False
+        p = self._my_participant(obj)
+        return p is not None and p.muted_until is not None and timezone.now() < p.muted_until
 
     def get_is_locked(self, obj):
-        request = self.context.get('request')
-        if not request:
-            return False
-        participant = obj.conversation_participants.filter(user=request.user).first()
-        return getattr(participant, 'is_locked', False)
+        return getattr(self._my_participant(obj), 'is_locked', False)
 
     def get_is_favorite(self, obj):
-        request = self.context.get('request')
-        if not request:
-            return False
-        participant = obj.conversation_participants.filter(user=request.user).first()
-        return getattr(participant, 'is_favorite', False)
+        return getattr(self._my_participant(obj), 'is_favorite', False)
 
     def get_group_name(self, obj):
         if obj.conv_type == 'group':
@@ -306,3 +301,11 @@ class StorySerializer(serializers.ModelSerializer):
         if request and request.user.is_authenticated:
             return obj.views.filter(viewer=request.user).exists()
         return False
+
+
+class StoryViewerSerializer(serializers.ModelSerializer):
+    user = UserPublicSerializer(source='viewer', read_only=True)
+
+    class Meta:
+        model = StoryView
+        fields = ['user', 'viewed_at']
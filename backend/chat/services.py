@@ -0,0 +1,82 @@
+"""
+SecureChat - Chat Services
+==========================
+Logica condivisa tra le view chat (conversazioni private).
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+from .models import Conversation, ConversationParticipant
+
+
+class ConversationService:
+    """Creazione e riattivazione delle conversazioni private 1-a-1"""
+
+    @classmethod
+    def find_private(cls, user_id, other_user_id):
+        """
+        Conversazione privata tra i due utenti, anche se nascosta per uno dei due.
+        I due filter() separati sulla stessa relazione generano due join su
+        conversation_participants: una sola query.
+        """
+        return Conversation.objects.filter(
+            conv_type='private',
+        ).filter(
+            conversation_participants__user_id=user_id,
+        ).filter(
+            conversation_participants__user_id=other_user_id,
+        ).first()
+
+    @classmethod
+    def get_or_create_private(cls, user, other_user_id):
+        """
+        Restituisce (conversation, created, session_reset).
+
+        Se la conversazione esiste già riattiva i partecipanti nascosti; in quel
+        caso session_reset è True e l'altro utente riceve 'session.reset' via
+        WebSocket per rinegoziare la sessione E2E.
+        """
+        user_ids = [user.id, other_user_id]
+        with transaction.atomic():
+            existing = cls.find_private(user.id, other_user_id)
+            if existing is None:
+                conversation = Conversation.objects.create(conv_type='private')
+                ConversationParticipant.objects.bulk_create([
+                    ConversationParticipant(conversation=conversation, user_id=uid, role='member')
+                    for uid in user_ids
+                ])
+                return conversation, True, False
+
+            # Riattiva entrambi i partecipanti se hidden: righe bloccate, una sola UPDATE.
+            # find_private() richiede già entrambe le righe, non serve ricrearle.
+            participants = list(
+                ConversationParticipant.objects.select_for_update()
+                .filter(conversation=existing, user_id__in=user_ids)
+                .only('id', 'user_id', 'is_hidden')
+            )
+            session_reset = any(p.is_hidden for p in participants)
+            if session_reset:
+                ConversationParticipant.objects.filter(
+                    id__in=[p.id for p in participants if p.is_hidden],
+                ).update(is_hidden=False, cleared_at=timezone.now())
+
+        if session_reset:
+            cls._notify_session_reset(existing, user, other_user_id)
+        return existing, False, session_reset
+
+    @classmethod
+    def _notify_session_reset(cls, conversation, user, other_user_id):
+        # L'altro partecipante è già noto dal chiamante ed è appena stato riattivato
+        if other_user_id == user.id:
+            return
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            f'user_{other_user_id}',
+            {
+                'type': 'session.reset',
+                'conversation_id': str(conversation.id),
+                'reset_user_id': user.id,
+            },
+        )
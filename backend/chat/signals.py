@@ -0,0 +1,57 @@
+"""
+Invalidazione della cache dei link d'invito dei gruppi (Group.get_invite_cached).
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Group
+
+
+@receiver(pre_save, sender=Group)
+def remember_previous_invite_link(sender, instance, update_fields=None, **kwargs):
+    """Link precedente: se viene rigenerato, il vecchio non deve restare valido in cache."""
+    instance._previous_invite_link = None
+    if instance._state.adding or (update_fields is not None and 'invite_link' not in update_fields):
+        return
+    try:
+        instance._previous_invite_link = instance._loaded_invite_link
+    except AttributeError:
+        # Istanza non caricata dal DB o con invite_link deferred: si rilegge
+        instance._previous_invite_link = Group.objects.filter(pk=instance.pk).values_list(
+            'invite_link', flat=True,
+        ).first()
+
+
+@receiver(post_save, sender=Group)
+def remember_saved_invite_link(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'invite_link' in update_fields:
+        instance._loaded_invite_link = instance.invite_link
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_invite_cache(sender, instance, **kwargs):
+    links = {instance.invite_link, getattr(instance, '_previous_invite_link', None)} - {None}
+    if links:
+        cache.delete_many([Group.INVITE_CACHE.format(link) for link in links])
+
+
+@receiver(post_save, sender=Group)
+def prime_invite_cache(sender, instance, **kwargs):
+    """
+    Write-through: il primo join dopo creazione o modifica trova già il link in
+    cache. Solo dopo il commit, per non pubblicare un gruppo poi annullato.
+    """
+    if not instance.invite_link:
+        return
+    info = {
+        'conversation_id': instance.conversation_id,
+        'name': instance.name,
+        'max_members': instance.max_members,
+        'invite_link_expires': instance.invite_link_expires,
+    }
+    transaction.on_commit(lambda: cache.set(
+        Group.INVITE_CACHE.format(instance.invite_link), info, Group.INVITE_CACHE_TTL,
+    ))
@@ -15,3 +15,192 @@ def send_push_async(self, conversation_id, sender_user_id, push_title, push_body
     except Exception as e:
         logger.error('[PushAsync] error: %s', e)
         raise self.retry(exc=e)
+
+    # APNs push diretto per messaggi (banner di sistema iOS); fuori dal retry
+    # per non reinviare la push del notify server
+    try:
+        from chat.apns_push import send_message_push
+        for recipient in conversation.participants.exclude(id=sender_user_id):
+            send_message_push(recipient, push_title, push_body, push_data)
+    except Exception as e:
+        logger.error('[PushAsync] APNs direct push error: %s', e)
+
+
+OFFICE_CONVERT_LOCK = 'office-convert:{}'
+OFFICE_CONVERT_ERROR = 'office-convert-error:{}'
+OFFICE_CONVERT_TIMEOUT = 60
+
+
+def converted_pdf_path(original_path):
+    return original_path.rsplit('.', 1)[0] + '_converted.pdf'
+
+
+@shared_task(name='chat.convert_attachment_to_pdf', ignore_result=True)
+def convert_attachment_to_pdf(attachment_id, original_path):
+    """
+    Converte un allegato Office in PDF con LibreOffice headless, fuori dal ciclo
+    richiesta. Il lock in cache (preso da OfficeConvertView) deduplica le
+    conversioni concorrenti dello stesso allegato; un errore resta in cache per
+    la richiesta successiva.
+    """
+    import os
+    import subprocess
+    from django.core.cache import cache
+
+    pdf_path = converted_pdf_path(original_path)
+    try:
+        if os.path.exists(pdf_path):
+            return
+        result = subprocess.run(
+            [
+                'libreoffice', '--headless', '--convert-to', 'pdf',
+                '--outdir', os.path.dirname(original_path), original_path,
+            ],
+            capture_output=True,
+            timeout=OFFICE_CONVERT_TIMEOUT,
+        )
+        # LibreOffice genera file con stesso nome ma .pdf
+        generated_pdf = original_path.rsplit('.', 1)[0] + '.pdf'
+        if os.path.exists(generated_pdf) and generated_pdf != pdf_path:
+            os.replace(generated_pdf, pdf_path)
+        if not os.path.exists(pdf_path):
+            cache.set(OFFICE_CONVERT_ERROR.format(attachment_id), {
+                'error': 'Conversion failed',
+                'stderr': (result.stderr or b'').decode('utf-8', errors='ignore'),
+            }, 300)
+    except subprocess.TimeoutExpired:
+        cache.set(OFFICE_CONVERT_ERROR.format(attachment_id), {'error': 'Conversion timeout'}, 300)
+    except Exception as e:
+        logger.error('[OfficeConvert] error for %s: %s', attachment_id, e)
+        cache.set(OFFICE_CONVERT_ERROR.format(attachment_id), {'error': str(e)}, 300)
+    finally:
+        cache.delete(OFFICE_CONVERT_LOCK.format(attachment_id))
+
+
+def make_image_thumbnail(fileobj, name, size=(300, 300)):
+    """
+    Thumbnail JPEG di un'immagine. Per i JPEG draft() fa decodificare a libjpeg
+    direttamente a 1/2-1/8 della risoluzione (scala DCT): niente bitmap a piena
+    risoluzione in memoria.
+    """
+    from io import BytesIO
+    from PIL import Image
+    from django.core.files.base import ContentFile
+
+    img = Image.open(fileobj)
+    img.draft('RGB', (size[0] * 2, size[1] * 2))
+    if img.mode != 'RGB':
+        # PNG/GIF/WebP con alpha o palette: il JPEG vuole RGB
+        img = img.convert('RGB')
+    img.thumbnail(size, Image.LANCZOS, reducing_gap=2.0)
+    thumb_io = BytesIO()
+    img.save(thumb_io, format='JPEG', quality=70)
+    return ContentFile(thumb_io.getvalue(), name=f'thumb_{name}.jpg')
+
+
+@shared_task(name='chat.finalize_attachment', ignore_result=True)
+def finalize_attachment(attachment_id, sender_user_id, make_thumbnail):
+    """
+    Completa un allegato caricato via REST fuori dal ciclo richiesta: genera la
+    thumbnail (immagini) e notifica i partecipanti che il messaggio ha l'allegato.
+    """
+    import json
+    import os
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from chat.models import Attachment, Message
+    from chat.serializers import MessageSerializer
+
+    try:
+        attachment = Attachment.objects.get(id=attachment_id)
+    except Attachment.DoesNotExist:
+        return
+
+    if make_thumbnail and not attachment.thumbnail:
+        try:
+            with attachment.file.open('rb') as f:
+                thumbnail = make_image_thumbnail(f, os.path.basename(attachment.file_name))
+            attachment.thumbnail.save(thumbnail.name, thumbnail, save=False)
+            attachment.save(update_fields=['thumbnail'])
+        except Exception as e:
+            logger.error('[FinalizeAttachment] thumbnail error for %s: %s', attachment_id, e)
+
+    # Broadcast WebSocket: messaggio ora ha l'allegato, notifica i partecipanti
+    try:
+        message = Message.objects.select_related('sender').prefetch_related('attachments').get(id=attachment.message_id)
+        message_data = json.loads(json.dumps(MessageSerializer(message).data, default=str))
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(f'conv_{message.conversation_id}', {
+                'type': 'chat.message',
+                'message': message_data,
+                'sender_id': sender_user_id,
+            })
+    except Exception as e:
+        logger.error('[FinalizeAttachment] WS broadcast error: %s', e)
+
+
+EVENT_ICS_CACHE = 'event-ics:{}'
+EVENT_ICS_CACHE_TTL = 24 * 3600
+
+
+def _event_ics_content(event):
+    """Contenuto .ics dell'evento; condiviso in cache tra eventi identici (re-share)."""
+    import hashlib
+    from django.core.cache import cache
+
+    fields = (event.title, event.description, event.start_datetime.isoformat(),
+              event.end_datetime.isoformat(), event.location)
+    cache_key = EVENT_ICS_CACHE.format(hashlib.sha256('\x1f'.join(fields).encode()).hexdigest())
+    ics_content = cache.get(cache_key)
+    if ics_content is None:
+        from icalendar import Calendar, Event as ICalEvent
+
+        cal = Calendar()
+        cal.add('prodid', '-//SecureChat//EN')
+        cal.add('version', '2.0')
+        ical_event = ICalEvent()
+        ical_event.add('summary', event.title)
+        ical_event.add('description', event.description)
+        ical_event.add('dtstart', event.start_datetime)
+        ical_event.add('dtend', event.end_datetime)
+        if event.location:
+            ical_event.add('location', event.location)
+        cal.add_component(ical_event)
+        ics_content = cal.to_ical()
+        cache.set(cache_key, ics_content, EVENT_ICS_CACHE_TTL)
+    return ics_content
+
+
+@shared_task(name='chat.build_event_ics', ignore_result=True)
+def build_event_ics(event_id):
+    """Genera e salva il file .ics di un evento condiviso, fuori dal ciclo richiesta."""
+    from django.core.files.base import ContentFile
+    from chat.models import CalendarEvent
+
+    try:
+        event = CalendarEvent.objects.get(id=event_id)
+    except CalendarEvent.DoesNotExist:
+        return
+    if event.ics_file:
+        return
+
+    try:
+        ics_content = _event_ics_content(event)
+        event.ics_file.save(f'event_{event.id}.ics', ContentFile(ics_content), save=False)
+        event.save(update_fields=['ics_file'])
+    except Exception as e:
+        logger.error('[EventIcs] error for %s: %s', event_id, e)
+
+
+@shared_task(name='chat.create_system_message', ignore_result=True)
+def create_system_message(conversation_id, sender_id, text):
+    """Messaggio di sistema di un gruppo (aggiunta, rimozione, ingresso), fuori dal ciclo richiesta."""
+    from chat.models import Message
+
+    Message.objects.create(
+        conversation_id=conversation_id,
+        sender_id=sender_id,
+        message_type='system',
+        content_for_translation=text,
+    )
@@ -1,47 +1,104 @@
-from django.urls import path, include
-from . import views
+import functools
+import sys
 
-urlpatterns = [
-    # E2EE encrypted media (zero-knowledge)
+from django.urls import path, include, register_converter
+from django.views.decorators.csrf import csrf_exempt
+from .converters import FastUUIDConverter, InviteCodeConverter, SafeMediaPathConverter
+from .resolvers import indexed
+
+# Registrati prima di urlpatterns: le route <fastuuid:...>, <mpath:...> e <invite:...> li usano
+register_converter(FastUUIDConverter, 'fastuuid')
+register_converter(SafeMediaPathConverter, 'mpath')
+register_converter(InviteCodeConverter, 'invite')
+
+
+@functools.lru_cache(maxsize=None)
+def _as_view(name):
+    from . import views
+    return getattr(views, name).as_view()
+
+
+def _lazy(name):
+    """
+    View che importa chat.views solo alla prima richiesta: i worker che non
+    servono mai la chat non pagano l'import (requests, bs4, PIL, icalendar...).
+    csrf_exempt va dichiarato qui perché il CsrfViewMiddleware ispeziona il
+    callback prima che la view DRF reale venga creata.
+    """
+    @csrf_exempt
+    def view(request, *args, **kwargs):
+        return _as_view(name)(request, *args, **kwargs)
+    view.__name__ = view.__qualname__ = name
+    view.__module__ = 'chat.views'
+    return view
+
+
+# Conversations (POST on conversation-list also creates private conv with body: participants + conv_type)
+conversation_patterns = [
+    path('', _lazy('ConversationListView'), name='conversation-list'),
+    path('create/', _lazy('CreatePrivateConversationView'), name='create-private'),
+    path('<fastuuid:conversation_id>/', _lazy('ConversationDetailView'), name='conversation-detail'),
+    path('<fastuuid:conversation_id>/messages/', _lazy('MessageListView'), name='message-list'),
+    path('<fastuuid:conversation_id>/participants/<int:user_id>/', _lazy('ConversationParticipantDetailView'), name='conversation-participant-detail'),
+    # read, mute, clear, leave, delete-for-all, avatar, participants, lock, favorite,
+    # lock-secret, unlock, location, event, search (vedi ConversationActionRouterView.ACTIONS)
+    path('<fastuuid:conversation_id>/<slug:action>/', _lazy('ConversationActionRouterView'), name='conversation-action'),
+]
+
+message_patterns = [
+    path('<fastuuid:message_id>/react/', _lazy('ReactionView'), name='message-react'),
+    path('<fastuuid:message_id>/', _lazy('MessageEditView'), name='message-edit'),
+]
+
+group_patterns = [
+    path('', _lazy('CreateGroupView'), name='create-group'),
+    path('<fastuuid:conversation_id>/members/', _lazy('GroupMembersView'), name='group-members'),
+    path('join/<invite:invite_code>/', _lazy('GroupJoinView'), name='group-join'),
+]
+
+story_patterns = [
+    path('', _lazy('StoryCreateView'), name='story-create'),
+    path('feed/', _lazy('StoryFeedView'), name='story-feed'),
+    # view, viewers (vedi StoryActionRouterView.ACTIONS)
+    path('<fastuuid:story_id>/<slug:action>/', _lazy('StoryActionRouterView'), name='story-action'),
+    path('<fastuuid:story_id>/', _lazy('StoryDeleteView'), name='story-delete'),
+]
+
+# E2EE encrypted media (zero-knowledge) prima del serve generico su media/<path>
+media_patterns = [
     path('', include('chat.media_urls')),
-    path('lock-pin/', views.LockPinView.as_view(), name='lock-pin'),
-    # Conversations (POST on conversation-list also creates private conv with body: participants + conv_type)
-    path('conversations/', views.ConversationListView.as_view(), name='conversation-list'),
-    path('conversations/create/', views.CreatePrivateConversationView.as_view(), name='create-private'),
-    path('conversations/<uuid:conversation_id>/', views.ConversationDetailView.as_view(), name='conversation-detail'),
-    path('conversations/<uuid:conversation_id>/messages/', views.MessageListView.as_view(), name='message-list'),
-    path('conversations/<uuid:conversation_id>/read/', views.MarkAsReadView.as_view(), name='mark-as-read'),
-    path('conversations/<uuid:conversation_id>/mute/', views.ConversationMuteView.as_view(), name='conversation-mute'),
-    path('conversations/<uuid:conversation_id>/clear/', views.ConversationClearView.as_view(), name='conversation-clear'),
-    path('conversations/<uuid:conversation_id>/leave/', views.ConversationLeaveView.as_view(), name='conversation-leave'),
-    path('conversations/<uuid:conversation_id>/delete-for-all/', views.ConversationDeleteForAllView.as_view()),
-    path('conversations/<uuid:conversation_id>/avatar/', views.ConversationAvatarView.as_view(), name='conversation-avatar'),
-    path('conversations/<uuid:conversation_id>/participants/', views.ConversationParticipantsView.as_view(), name='conversation-participants'),
-    path('conversations/<uuid:conversation_id>/participants/<int:user_id>/', views.ConversationParticipantDetailView.as_view(), name='conversation-participant-detail'),
-    # Chat features
-    path('conversations/<uuid:conversation_id>/lock/', views.ConversationLockView.as_view(), name='conversation-lock'),
-    path('conversations/<uuid:conversation_id>/favorite/', views.ConversationFavoriteView.as_view(), name='conversation-favorite'),
-    path('conversations/<uuid:conversation_id>/lock-secret/', views.LockChatView.as_view(), name='lock-chat'),
-    path('conversations/<uuid:conversation_id>/unlock/', views.UnlockChatView.as_view(), name='unlock-chat'),
-    path('conversations/<uuid:conversation_id>/location/', views.LocationShareView.as_view(), name='share-location'),
-    path('conversations/<uuid:conversation_id>/event/', views.CalendarEventView.as_view(), name='create-event'),
-    path('conversations/<uuid:conversation_id>/search/', views.SearchMessagesView.as_view(), name='search-messages'),
+    path('<mpath:file_path>', _lazy('MediaServeView'), name='media-serve'),
+]
+
+root_patterns = [
+    path('lock-pin/', _lazy('LockPinView'), name='lock-pin'),
     # Attachments
-    path('upload/', views.AttachmentUploadView.as_view(), name='upload-attachment'),
-    path('media/<path:file_path>', views.MediaServeView.as_view(), name='media-serve'),
-    path('convert/<uuid:attachment_id>/', views.OfficeConvertView.as_view(), name='office-convert'),
-    # Messages
-    path('messages/<uuid:message_id>/react/', views.ReactionView.as_view(), name='message-react'),
-    path('messages/<uuid:message_id>/', views.MessageEditView.as_view(), name='message-edit'),
-    path('link-preview/', views.LinkPreviewView.as_view(), name='link-preview'),
-    # Groups
-    path('groups/', views.CreateGroupView.as_view(), name='create-group'),
-    path('groups/<uuid:conversation_id>/members/', views.GroupMembersView.as_view(), name='group-members'),
-    path('groups/join/<str:invite_code>/', views.GroupJoinView.as_view(), name='group-join'),
-    # Stories
-    path('stories/', views.StoryCreateView.as_view(), name='story-create'),
-    path('stories/feed/', views.StoryFeedView.as_view(), name='story-feed'),
-    path('stories/<uuid:story_id>/view/', views.StoryViewRegisterView.as_view(), name='story-view'),
-    path('stories/<uuid:story_id>/viewers/', views.StoryViewersView.as_view(), name='story-viewers'),
-    path('stories/<uuid:story_id>/', views.StoryDeleteView.as_view(), name='story-delete'),
+    path('upload/', _lazy('AttachmentUploadView'), name='upload-attachment'),
+    path('convert/<fastuuid:attachment_id>/', _lazy('OfficeConvertView'), name='office-convert'),
+    path('link-preview/', _lazy('LinkPreviewView'), name='link-preview'),
+]
+
+# Ogni include() con prefisso proprio: i sottoalberi che non matchano vengono saltati
+_patterns = [
+    path('conversations/', include(conversation_patterns)),
+    path('messages/', include(message_patterns)),
+    path('groups/', include(group_patterns)),
+    path('stories/', include(story_patterns)),
+    path('media/', include(media_patterns)),
+    *root_patterns,
 ]
+
+
+def _intern_names(patterns):
+    """sys.intern() sui name=, anche dentro gli include annidati."""
+    for p in patterns:
+        if getattr(p, 'name', None):
+            p.name = sys.intern(p.name)
+        _intern_names(getattr(p, 'url_patterns', ()))
+
+
+_intern_names(_patterns)
+
+# Risoluzione O(1) sul primo segmento del path (vedi chat.resolvers).
+# Solo il livello esterno è una tupla: include() interpreta una tupla come (urlconf, app_name).
+urlpatterns = (indexed(_patterns),)
@@ -1,42 +1,155 @@
+import asyncio
+import functools
+import logging
+import mimetypes
 import os
 import json
 import re
-import subprocess
+import stat
 import uuid
 import bcrypt
+from urllib.parse import quote
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import MappingProxyType
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.http import FileResponse, HttpResponse, JsonResponse
 from django.utils import timezone
-from django.db import models
-from django.db.models import Q, Prefetch, Count
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import conditional_page
+from django.views.decorators.vary import vary_on_headers
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Q, F, Prefetch, Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.pagination import CursorPagination
+from rest_framework.throttling import UserRateThrottle
 from .models import (
     Conversation, ConversationParticipant, Message, Attachment,
     MessageStatus, MessageReaction, LocationShare, ContactShare,
     CalendarEvent, Group, Story, StoryView
 )
+from .services import ConversationService
+from .tasks import (
+    OFFICE_CONVERT_ERROR, OFFICE_CONVERT_LOCK, OFFICE_CONVERT_TIMEOUT,
+    build_event_ics, convert_attachment_to_pdf, converted_pdf_path, create_system_message,
+    finalize_attachment,
+)
+from accounts.serializers import UserPublicSerializer
 from .serializers import (
     ConversationListSerializer, ConversationDetailSerializer,
     MessageSerializer, CreatePrivateConversationSerializer,
     CreateGroupSerializer, LockChatSerializer, StorySerializer,
-    AttachmentSerializer
+    StoryViewerSerializer, AttachmentSerializer
 )
 
 
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+User = get_user_model()
+
+# Il channel layer è un singleton dopo l'avvio: niente lookup per richiesta.
+# Riletto se i test cambiano CHANNEL_LAYERS (override_settings)
+CHANNEL_LAYER = get_channel_layer()
+
+
+@receiver(setting_changed)
+def _reset_channel_layer(setting, **kwargs):
+    global CHANNEL_LAYER
+    if setting == 'CHANNEL_LAYERS':
+        CHANNEL_LAYER = get_channel_layer()
+
+
+def _ws_broadcast(group, payload):
+    """Un evento WebSocket a un gruppo, sul channel layer del modulo."""
+    async_to_sync(CHANNEL_LAYER.group_send)(group, payload)
+
+
+async def _group_send_many(channel_layer, sends):
+    """group_send concorrenti in un solo giro di event loop: [(group, payload), ...]."""
+    await asyncio.gather(*(channel_layer.group_send(group, payload) for group, payload in sends))
+
+
+# MEDIA_ROOT risolto una volta (realpath = un readlink per componente del path)
+MEDIA_ROOT_REAL = os.path.realpath(settings.MEDIA_ROOT)
+
+
+@receiver(setting_changed)
+def _reset_media_root(setting, **kwargs):
+    global MEDIA_ROOT_REAL
+    if setting == 'MEDIA_ROOT':
+        MEDIA_ROOT_REAL = os.path.realpath(settings.MEDIA_ROOT)
+
+
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
 class MessagePagination(CursorPagination):
     page_size = 50
-    ordering = '-created_at'
+    # id come tie-break: ordine stabile tra messaggi con lo stesso created_at
+    ordering = ('-created_at', '-id')
     cursor_query_param = 'cursor'
 
 
+# Liste interrogate in polling dal client (conversations/, stories/feed/):
+# ETag calcolato sul body → 304 senza payload sui poll ripetuti, cache solo
+# privata e di pochi secondi.
+POLL_CACHE = [
+    conditional_page,
+    cache_control(private=True, max_age=5, stale_while_revalidate=10),
+    vary_on_headers('Authorization'),
+]
+
+
+# Colonne User lette da UserPublicSerializer: password, email, token push e chiavi restano nel DB
+PUBLIC_USER_FIELDS = tuple(UserPublicSerializer.Meta.fields)
+
+
+def _only_public_user(model, relation):
+    """Campi per .only(): tutte le colonne di model, dell'utente in relation solo quelle pubbliche."""
+    return (
+        *(f.name for f in model._meta.concrete_fields),
+        *(f'{relation}__{name}' for name in PUBLIC_USER_FIELDS),
+    )
+
+
+def _reply_to_prefetch():
+    """Messaggio citato: solo le colonne usate da reply_to_preview, niente payload cifrato."""
+    return Prefetch('reply_to', queryset=Message.objects.select_related('sender').only(
+        'id', 'message_type', 'is_deleted', 'sender', 'sender__first_name', 'sender__last_name',
+    ))
+
+
+def _attach_last_visible_messages(conversations):
+    """Carica in una sola query i messaggi indicati da last_visible_message_id."""
+    ids = [c.last_visible_message_id for c in conversations if c.last_visible_message_id]
+    messages = Message.objects.select_related('sender').only(
+        *_only_public_user(Message, 'sender'),
+    ).prefetch_related(
+        'attachments', 'statuses', 'reactions',
+        'location', 'shared_contact', 'calendar_event',
+        _reply_to_prefetch(),
+    ).in_bulk(ids)
+    for conversation in conversations:
+        conversation.last_visible_message = messages.get(conversation.last_visible_message_id)
+
+
 class ConversationListView(APIView):
     """
     GET  /api/chat/conversations/ — list conversations for current user.
@@ -45,25 +158,51 @@ class ConversationListView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @method_decorator(POLL_CACHE)
     def get(self, request):
         """List all conversations for current user, ordered by last activity"""
         conversations = Conversation.objects.filter(
             conversation_participants__user=request.user,
             conversation_participants__is_hidden=False,
-        ).select_related('last_message', 'last_message__sender').prefetch_related(
-            'conversation_participants__user',
+        ).annotate(
+            # Ultimo messaggio visibile (dopo cleared_at dell'utente): la subquery
+            # riusa la join sui partecipanti del filtro sopra
+            last_visible_message_id=Subquery(
+                Message.objects.filter(
+                    conversation=OuterRef('pk'),
+                    is_deleted=False,
+                    created_at__gt=Coalesce(
+                        OuterRef('conversation_participants__cleared_at'), Value(EPOCH),
+                    ),
+                ).order_by('-created_at').values('id')[:1]
+            ),
+        ).prefetch_related(
+            Prefetch(
+                'conversation_participants',
+                queryset=ConversationParticipant.objects.select_related('user').only(
+                    *_only_public_user(ConversationParticipant, 'user'),
+                ),
+            ),
             'group_info',
-        ).order_by('-updated_at')
+        ).only('id', 'conv_type', 'created_at', 'updated_at').order_by('-updated_at')
 
         # Search filter
         search = request.query_params.get('search', '')
         if search:
+            # EXISTS invece di JOIN + distinct(): una riga per conversazione,
+            # la subquery si ferma al primo partecipante che matcha
             conversations = conversations.filter(
-                Q(group_info__name__icontains=search) |
-                Q(conversation_participants__user__first_name__icontains=search) |
-                Q(conversation_participants__user__last_name__icontains=search)
-            ).distinct()
+                Exists(Group.objects.filter(
+                    conversation=OuterRef('pk'), name__icontains=search,
+                )) |
+                Exists(ConversationParticipant.objects.filter(
+                    Q(user__first_name__icontains=search) | Q(user__last_name__icontains=search),
+                    conversation=OuterRef('pk'),
+                ))
+            )
 
+        conversations = list(conversations)
+        _attach_last_visible_messages(conversations)
         serializer = ConversationListSerializer(
             conversations, many=True, context={'request': request}
         )
@@ -84,24 +223,33 @@ class ConversationListView(APIView):
             if len(participants) < 2:
                 return Response({'error': 'Servono almeno 2 partecipanti.'}, status=status.HTTP_400_BAD_REQUEST)
 
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            valid_users = User.objects.filter(id__in=participants)
-            if valid_users.count() != len(participants):
+            try:
+                requested_ids = {int(uid) for uid in participants}
+            except (TypeError, ValueError):
                 return Response({'error': 'Uno o più utenti non esistono.'}, status=status.HTTP_400_BAD_REQUEST)
+            # Solo gli id (index-only), niente COUNT: la differenza dice anche quali mancano
+            valid_ids = set(User.objects.filter(id__in=requested_ids).values_list('id', flat=True))
+            missing_ids = requested_ids - valid_ids
+            if missing_ids:
+                return Response(
+                    {'error': 'Uno o più utenti non esistono.', 'missing_ids': sorted(missing_ids)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-            conversation = Conversation.objects.create(conv_type='group')
-            from chat.models import Group
-            Group.objects.create(
-                conversation=conversation,
-                name=name,
-                description=request.data.get('description', ''),
-                created_by=request.user,
-            )
-            ConversationParticipant.objects.create(conversation=conversation, user=request.user, role='admin')
-            for user in valid_users:
-                if user.id != request.user.id:
-                    ConversationParticipant.objects.create(conversation=conversation, user=user, role='member')
+            with transaction.atomic():
+                conversation = Conversation.objects.create(conv_type='group')
+                Group.objects.create(
+                    conversation=conversation,
+                    name=name,
+                    description=request.data.get('description', ''),
+                    created_by=request.user,
+                )
+                ConversationParticipant.objects.bulk_create(
+                    [ConversationParticipant(conversation=conversation, user=request.user, role='admin')] + [
+                        ConversationParticipant(conversation=conversation, user_id=uid, role='member')
+                        for uid in valid_ids if uid != request.user.id
+                    ]
+                )
 
             serializer = ConversationDetailSerializer(conversation, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -131,60 +279,15 @@ class ConversationListView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Cerca conversazione privata che ha other_user come partecipante (indipendentemente da is_hidden)
-        other_conv_ids = ConversationParticipant.objects.filter(
-            user_id=other_user_id,
-            conversation__conv_type='private'
-        ).values('conversation_id')
-
-        # Cerca se request.user è partecipante (anche hidden)
-        existing = Conversation.objects.filter(
-            id__in=other_conv_ids,
-            conversation_participants__user=request.user
-        ).first()
-
-        if existing:
-            session_reset = False
-            # Riattiva entrambi i partecipanti se hidden
-            for uid in [request.user.id, other_user_id]:
-                participant, created = ConversationParticipant.objects.get_or_create(
-                    conversation=existing,
-                    user_id=uid,
-                    defaults={'role': 'member', 'cleared_at': timezone.now()}
-                )
-                if not created and participant.is_hidden:
-                    participant.is_hidden = False
-                    participant.cleared_at = timezone.now()
-                    participant.save()
-                    session_reset = True
-            serializer = ConversationDetailSerializer(existing, context={'request': request})
-            data = dict(serializer.data)
-            data['session_reset'] = session_reset
-            if session_reset:
-                channel_layer = get_channel_layer()
-                other_participant = ConversationParticipant.objects.filter(
-                    conversation=existing,
-                    is_hidden=False,
-                ).exclude(user=request.user).first()
-                if other_participant:
-                    user_group = f'user_{other_participant.user.id}'
-                    async_to_sync(channel_layer.group_send)(
-                        user_group,
-                        {
-                            'type': 'session.reset',
-                            'conversation_id': str(existing.id),
-                            'reset_user_id': request.user.id,
-                        },
-                    )
-            return Response(data, status=status.HTTP_200_OK)
-
-        # Nessuna conversazione esistente — crea nuova
-        conversation = Conversation.objects.create(conv_type='private')
-        ConversationParticipant.objects.create(conversation=conversation, user=request.user, role='member')
-        ConversationParticipant.objects.create(conversation=conversation, user_id=other_user_id, role='member')
-
+        conversation, created, session_reset = ConversationService.get_or_create_private(
+            request.user, other_user_id,
+        )
         serializer = ConversationDetailSerializer(conversation, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if created:
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        data = dict(serializer.data)
+        data['session_reset'] = session_reset
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class CreatePrivateConversationView(APIView):
@@ -200,60 +303,15 @@ class CreatePrivateConversationView(APIView):
             return Response({'error': 'Non puoi chattare con te stesso.'},
                           status=status.HTTP_400_BAD_REQUEST)
 
-        # Cerca conversazione privata che ha other_user come partecipante (indipendentemente da is_hidden)
-        other_conv_ids = ConversationParticipant.objects.filter(
-            user_id=other_user_id,
-            conversation__conv_type='private'
-        ).values('conversation_id')
-
-        # Cerca se request.user è partecipante (anche hidden)
-        existing = Conversation.objects.filter(
-            id__in=other_conv_ids,
-            conversation_participants__user=request.user
-        ).first()
-
-        if existing:
-            session_reset = False
-            # Riattiva entrambi i partecipanti se hidden
-            for uid in [request.user.id, other_user_id]:
-                participant, created = ConversationParticipant.objects.get_or_create(
-                    conversation=existing,
-                    user_id=uid,
-                    defaults={'role': 'member', 'cleared_at': timezone.now()}
-                )
-                if not created and participant.is_hidden:
-                    participant.is_hidden = False
-                    participant.cleared_at = timezone.now()
-                    participant.save()
-                    session_reset = True
-            serializer = ConversationDetailSerializer(existing, context={'request': request})
-            data = dict(serializer.data)
-            data['session_reset'] = session_reset
-            if session_reset:
-                channel_layer = get_channel_layer()
-                other_participant = ConversationParticipant.objects.filter(
-                    conversation=existing,
-                    is_hidden=False,
-                ).exclude(user=request.user).first()
-                if other_participant:
-                    user_group = f'user_{other_participant.user.id}'
-                    async_to_sync(channel_layer.group_send)(
-                        user_group,
-                        {
-                            'type': 'session.reset',
-                            'conversation_id': str(existing.id),
-                            'reset_user_id': request.user.id,
-                        },
-                    )
-            return Response(data, status=status.HTTP_200_OK)
-
-        # Nessuna conversazione esistente — crea nuova
-        conversation = Conversation.objects.create(conv_type='private')
-        ConversationParticipant.objects.create(conversation=conversation, user=request.user, role='member')
-        ConversationParticipant.objects.create(conversation=conversation, user_id=other_user_id, role='member')
-
+        conversation, created, session_reset = ConversationService.get_or_create_private(
+            request.user, other_user_id,
+        )
         serializer = ConversationDetailSerializer(conversation, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if created:
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        data = dict(serializer.data)
+        data['session_reset'] = session_reset
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class ConversationDetailView(APIView):
@@ -325,58 +383,72 @@ class ConversationParticipantDetailView(APIView):
     """Modifica ruolo o rimuovi un partecipante."""
     permission_classes = [IsAuthenticated]
 
+    @staticmethod
+    def _target(request, conversation_id, user_id):
+        """Riga del partecipante user_id, solo se chi chiama è admin della conversazione."""
+        return ConversationParticipant.objects.filter(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            conversation__conversation_participants__user=request.user,
+            conversation__conversation_participants__role='admin',
+        )
+
+    @staticmethod
+    def _rejected(request, conversation_id, user_id, forbidden_error, self_error=None):
+        """Nessuna riga toccata: ricostruisce l'errore (fuori dal percorso normale)."""
+        my_role = ConversationParticipant.objects.filter(
+            conversation_id=conversation_id, user=request.user
+        ).values_list('role', flat=True).first()
+        if my_role is None and not Conversation.objects.filter(id=conversation_id).exists():
+            return Response({'error': 'Conversazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
+        if my_role is not None and my_role != 'admin':
+            return Response({'error': forbidden_error}, status=status.HTTP_403_FORBIDDEN)
+        if my_role == 'admin' and self_error and user_id == request.user.id:
+            return Response({'error': self_error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'error': 'Partecipante non trovato'}, status=status.HTTP_404_NOT_FOUND)
+
     def patch(self, request, conversation_id, user_id):
         """Cambia ruolo di un partecipante (solo admin)."""
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            my_part = ConversationParticipant.objects.get(conversation=conversation, user=request.user)
-            if my_part.role != 'admin':
-                return Response({'error': 'Solo gli admin possono cambiare ruoli'}, status=status.HTTP_403_FORBIDDEN)
-            target = ConversationParticipant.objects.get(conversation=conversation, user_id=user_id)
-            new_role = request.data.get('role', target.role)
-            if new_role not in ('admin', 'member'):
-                return Response({'error': 'Ruolo non valido'}, status=status.HTTP_400_BAD_REQUEST)
-            target.role = new_role
-            target.save()
+        forbidden = 'Solo gli admin possono cambiare ruoli'
+        new_role = request.data.get('role')
+        if new_role is None:
+            # Nessun ruolo nel body: restituisce quello attuale
+            new_role = self._target(request, conversation_id, user_id).values_list('role', flat=True).first()
+            if new_role is None:
+                return self._rejected(request, conversation_id, user_id, forbidden)
             return Response({'role': new_role}, status=status.HTTP_200_OK)
-        except Conversation.DoesNotExist:
-            return Response({'error': 'Conversazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
-        except ConversationParticipant.DoesNotExist:
-            return Response({'error': 'Partecipante non trovato'}, status=status.HTTP_404_NOT_FOUND)
+        if new_role not in ('admin', 'member'):
+            return Response({'error': 'Ruolo non valido'}, status=status.HTTP_400_BAD_REQUEST)
+        if not self._target(request, conversation_id, user_id).update(role=new_role):
+            return self._rejected(request, conversation_id, user_id, forbidden)
+        return Response({'role': new_role}, status=status.HTTP_200_OK)
 
     def delete(self, request, conversation_id, user_id):
         """Rimuovi un partecipante (solo admin)."""
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            my_part = ConversationParticipant.objects.get(conversation=conversation, user=request.user)
-            if my_part.role != 'admin':
-                return Response({'error': 'Solo gli admin possono rimuovere membri'}, status=status.HTTP_403_FORBIDDEN)
-            target = ConversationParticipant.objects.get(conversation=conversation, user_id=user_id)
-            if target.user == request.user:
-                return Response({'error': 'Non puoi rimuovere te stesso'}, status=status.HTTP_400_BAD_REQUEST)
-            target.delete()
-            return Response({'removed': True}, status=status.HTTP_200_OK)
-        except Conversation.DoesNotExist:
-            return Response({'error': 'Conversazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
-        except ConversationParticipant.DoesNotExist:
-            return Response({'error': 'Partecipante non trovato'}, status=status.HTTP_404_NOT_FOUND)
+        deleted, _ = self._target(request, conversation_id, user_id).exclude(user=request.user).delete()
+        if not deleted:
+            return self._rejected(
+                request, conversation_id, user_id,
+                'Solo gli admin possono rimuovere membri', self_error='Non puoi rimuovere te stesso',
+            )
+        return Response({'removed': True}, status=status.HTTP_200_OK)
 
     def put(self, request, conversation_id, user_id):
         """Blocca o sblocca un partecipante (solo admin)."""
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            my_part = ConversationParticipant.objects.get(conversation=conversation, user=request.user)
-            if my_part.role != 'admin':
-                return Response({'error': 'Solo gli admin possono bloccare'}, status=status.HTTP_403_FORBIDDEN)
-            target = ConversationParticipant.objects.get(conversation=conversation, user_id=user_id)
-            action = request.data.get('action', 'block')
-            target.is_blocked = (action == 'block')
-            target.save()
-            return Response({'is_blocked': target.is_blocked}, status=status.HTTP_200_OK)
-        except Conversation.DoesNotExist:
-            return Response({'error': 'Conversazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
-        except ConversationParticipant.DoesNotExist:
-            return Response({'error': 'Partecipante non trovato'}, status=status.HTTP_404_NOT_FOUND)
+        is_blocked = request.data.get('action', 'block') == 'block'
+        if not self._target(request, conversation_id, user_id).update(is_blocked=is_blocked):
+            return self._rejected(request, conversation_id, user_id, 'Solo gli admin possono bloccare')
+        return Response({'is_blocked': is_blocked}, status=status.HTTP_200_OK)
+
+
+def _enqueue_message_push(push_args):
+    """Accoda la push del messaggio; se il broker non risponde la invia in linea."""
+    from chat.tasks import send_push_async
+    try:
+        send_push_async.delay(*push_args)
+    except Exception as e:
+        logger.error('Push enqueue error, invio diretto: %s', e)
+        send_push_async.apply(args=push_args)
 
 
 class MessageListView(APIView):
@@ -384,48 +456,47 @@ class MessageListView(APIView):
 
     def get(self, request, conversation_id):
         """List messages in a conversation with cursor pagination"""
-        try:
-            participant = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user
-            )
-        except ConversationParticipant.DoesNotExist:
-            return Response({'error': 'Accesso negato.'}, status=status.HTTP_403_FORBIDDEN)
-
+        # Accesso e cleared_at dell'utente nella stessa query dei messaggi:
+        # join sul suo ConversationParticipant (stesso filter(), stessa join)
         messages = Message.objects.filter(
-            conversation_id=conversation_id
-        ).select_related('sender').prefetch_related(
+            conversation_id=conversation_id,
+            conversation__conversation_participants__user=request.user,
+            created_at__gt=Coalesce(
+                F('conversation__conversation_participants__cleared_at'), Value(EPOCH),
+            ),
+        ).select_related('sender').only(
+            *_only_public_user(Message, 'sender'),
+        ).prefetch_related(
             'attachments', 'statuses', 'reactions',
             'location', 'shared_contact', 'calendar_event',
-            'reply_to__sender',
-        ).order_by('-created_at')
-
-        if participant.cleared_at:
-            messages = messages.filter(created_at__gt=participant.cleared_at)
+            _reply_to_prefetch(),
+        ).order_by('-created_at', '-id')
 
         paginator = MessagePagination()
         page = paginator.paginate_queryset(messages, request)
+        # Pagina vuota: solo qui serve distinguere "nessun messaggio" da "non partecipante"
+        if not page and not ConversationParticipant.objects.filter(
+            conversation_id=conversation_id, user=request.user
+        ).exists():
+            return Response({'error': 'Accesso negato.'}, status=status.HTTP_403_FORBIDDEN)
         serializer = MessageSerializer(page, many=True, context={'request': request})
         return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, conversation_id):
         """Send a message via REST (alternative to WebSocket)"""
-        if not ConversationParticipant.objects.filter(
+        # Accesso, tipo conversazione e blocco nel gruppo con una sola query
+        membership = ConversationParticipant.objects.filter(
             conversation_id=conversation_id, user=request.user
-        ).exists():
+        ).values('is_blocked', 'conversation__conv_type').first()
+        if membership is None:
             return Response({'error': 'Accesso negato.'}, status=status.HTTP_403_FORBIDDEN)
-
-        conversation = Conversation.objects.get(id=conversation_id)
+        conv_type = membership['conversation__conv_type']
         # Controlla se l'utente è bloccato nel gruppo
-        if conversation.conv_type == 'group':
-            try:
-                participant = ConversationParticipant.objects.get(conversation=conversation, user=request.user)
-                if participant.is_blocked:
-                    return Response(
-                        {'error': 'Sei stato bloccato in questo gruppo. Non puoi inviare messaggi.'},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
-            except ConversationParticipant.DoesNotExist:
-                pass
+        if conv_type == 'group' and membership['is_blocked']:
+            return Response(
+                {'error': 'Sei stato bloccato in questo gruppo. Non puoi inviare messaggi.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
 
         message_type = request.data.get('message_type', 'text')
         content_plain = request.data.get('content', '')
@@ -444,62 +515,70 @@ class MessageListView(APIView):
             # Plaintext from client (no E2EE yet): store for display and search
             encrypted_bytes = content_plain.encode('utf-8')
 
-        message = Message.objects.create(
-            conversation_id=conversation_id,
-            sender=request.user,
-            message_type=message_type,
-            content_encrypted=encrypted_bytes,
-            content_for_translation=content_plain or '',
-            reply_to_id=reply_to_id,
-        )
-
-        # ── Salva payload cifrati per destinatario (E2E gruppi fan-out) ──
+        # ── Payload cifrati per destinatario (E2E gruppi fan-out), decodificati prima della transazione ──
         recipients_encrypted = request.data.get('recipients_encrypted')
+        recipient_payloads = []
         if recipients_encrypted and isinstance(recipients_encrypted, dict):
-            from chat.models import MessageRecipient
             for user_id_str, encrypted_b64 in recipients_encrypted.items():
                 try:
-                    user_id = int(user_id_str)
-                    encrypted_bytes_recipient = base64.b64decode(encrypted_b64)
-                    MessageRecipient.objects.create(
-                        message=message,
-                        user_id=user_id,
-                        content_encrypted=encrypted_bytes_recipient,
-                    )
-                except (ValueError, Exception) as e:
-                    import logging
-                    logging.getLogger(__name__).error(f'Failed to save recipient payload for user {user_id_str}: {e}')
-
-        for att_id in attachment_ids:
-            try:
-                att = Attachment.objects.filter(id=att_id).first()
-                print(f'[ATTACH-DEBUG] att_id={att_id}, found={att is not None}, '
-                      f'owner={att.uploaded_by_id if att else None}, '
-                      f'msg={att.message_id if att else None}')
-                updated = Attachment.objects.filter(
-                    id=att_id,
+                    recipient_payloads.append((int(user_id_str), base64.b64decode(encrypted_b64)))
+                except (ValueError, TypeError) as e:
+                    logger.error(f'Failed to save recipient payload for user {user_id_str}: {e}')
+
+        # Scritture in un'unica transazione: niente messaggi senza stato o contatori a metà
+        with transaction.atomic():
+            message = Message.objects.create(
+                conversation_id=conversation_id,
+                sender=request.user,
+                message_type=message_type,
+                content_encrypted=encrypted_bytes,
+                content_for_translation=content_plain or '',
+                reply_to_id=reply_to_id,
+            )
+
+            if recipient_payloads:
+                from chat.models import MessageRecipient
+                # Un solo INSERT batch: scarta prima gli id che non sono partecipanti,
+                # altrimenti una FK non valida farebbe fallire l'intero batch
+                participant_ids = set(ConversationParticipant.objects.filter(
+                    conversation_id=conversation_id,
+                    user_id__in=[user_id for user_id, _ in recipient_payloads],
+                ).values_list('user_id', flat=True))
+                MessageRecipient.objects.bulk_create([
+                    MessageRecipient(message=message, user_id=user_id, content_encrypted=payload)
+                    for user_id, payload in recipient_payloads
+                    if user_id in participant_ids
+                ], batch_size=500)
+
+            # Collega gli allegati caricati dal mittente e non ancora assegnati (una sola UPDATE)
+            valid_attachment_ids = []
+            for att_id in attachment_ids:
+                try:
+                    valid_attachment_ids.append(uuid.UUID(str(att_id)))
+                except (ValueError, TypeError):
+                    pass
+            if valid_attachment_ids:
+                Attachment.objects.filter(
+                    id__in=valid_attachment_ids,
                     uploaded_by=request.user,
                     message__isnull=True,
                 ).update(message=message)
-                print(f'[ATTACH-DEBUG] updated={updated}')
-            except (ValueError, TypeError) as e:
-                print(f'[ATTACH-DEBUG] error={e}')
 
-        MessageStatus.objects.create(message=message, user=request.user, status='sent')
+            MessageStatus.objects.create(message=message, user=request.user, status='sent')
 
-        # Update conversation
-        Conversation.objects.filter(id=conversation_id).update(
-            last_message=message, updated_at=timezone.now()
-        )
+            # Update conversation
+            Conversation.objects.filter(id=conversation_id).update(
+                last_message=message, updated_at=timezone.now()
+            )
 
-        # Increment unread_count for all participants except sender
-        ConversationParticipant.objects.filter(
-            conversation_id=conversation_id
-        ).exclude(
-            user=request.user
-        ).update(
-            unread_count=models.F('unread_count') + 1
-        )
+            # Increment unread_count for all participants except sender
+            ConversationParticipant.objects.filter(
+                conversation_id=conversation_id
+            ).exclude(
+                user=request.user
+            ).update(
+                unread_count=models.F('unread_count') + 1
+            )
 
         # Non inviare broadcast per messaggi con allegati legacy: sarà l'endpoint di upload a farlo
         attachment_ids = request.data.get('attachment_ids') or []
@@ -507,25 +586,26 @@ class MessageListView(APIView):
 
         if not has_legacy_attachment:
             try:
-                channel_layer = get_channel_layer()
+                channel_layer = CHANNEL_LAYER
                 message_data = json.loads(json.dumps(MessageSerializer(message, context={'request': request}).data, default=str))
                 if channel_layer and recipients_encrypted and isinstance(recipients_encrypted, dict):
                     # E2E gruppo: invia a ogni partecipante il suo payload cifrato
-                    conversation = message.conversation
-                    participants = conversation.conversation_participants.select_related('user').all()
-                    for cp in participants:
-                        if cp.user_id == request.user.id:
-                            continue  # Non inviare al mittente
-                        user_group = f'user_{cp.user_id}'
-                        per_user_payload = dict(message_data)
-                        user_enc = recipients_encrypted.get(str(cp.user_id), '')
-                        per_user_payload['content_encrypted'] = user_enc
-                        per_user_payload.pop('content', None)  # Rimuovi plaintext
-                        async_to_sync(channel_layer.group_send)(user_group, {
+                    recipient_ids = ConversationParticipant.objects.filter(
+                        conversation_id=conversation_id,
+                    ).exclude(user=request.user).values_list('user_id', flat=True)
+                    # Payload condiviso senza plaintext; il blob cifrato del destinatario
+                    # viaggia a parte e il consumer lo rimette in message.content_encrypted
+                    message_data.pop('content', None)
+                    sends = [
+                        (f'user_{user_id}', {
                             'type': 'chat.message',
-                            'message': per_user_payload,
+                            'message': message_data,
+                            'content_encrypted_for_user': recipients_encrypted.get(str(user_id), ''),
                             'sender_id': request.user.id,
                         })
+                        for user_id in recipient_ids  # Non inviare al mittente
+                    ]
+                    async_to_sync(_group_send_many)(channel_layer, sends)
                 elif channel_layer:
                     # Messaggi normali (testo gruppi in chiaro, chat private)
                     conv_group = f'conv_{conversation_id}'
@@ -538,41 +618,26 @@ class MessageListView(APIView):
                         payload['content'] = content_plain
                     async_to_sync(channel_layer.group_send)(conv_group, payload)
             except Exception as e:
-                print(f'[MSG-BROADCAST] group_send error: {e}')
+                logger.error('[MSG-BROADCAST] group_send error: %s', e)
 
-        # Invia notifica push ai partecipanti offline
-        try:
-            from chat.push_notifications import send_push_to_conversation_participants
-            sender_name = f"{request.user.first_name} {request.user.last_name}".strip() or request.user.username
-            if conversation.conv_type == 'group':
-                group_name = 'Gruppo'
-                try:
-                    group_name = conversation.group_info.name
-                except Exception:
-                    pass
-                push_title = group_name
-                push_body = f"{sender_name}: Nuovo messaggio"
-            else:
-                push_title = sender_name
-                push_body = "Nuovo messaggio"
-            push_data = {
-                'conversation_id': str(conversation.id),
-                'message_type': message_type or 'text',
-            }
-            send_push_to_conversation_participants(conversation, request.user, push_title, push_body, push_data)
-
-            # APNs push diretto per messaggi (banner di sistema iOS)
-            try:
-                from chat.apns_push import send_message_push
-                participants = conversation.participants.exclude(id=request.user.id)
-                for recipient in participants:
-                    send_message_push(recipient, push_title, push_body, push_data)
-            except Exception as e:
-                import logging
-                logging.getLogger(__name__).error("APNs direct push error: %s", e)
-        except Exception as e:
-            import logging
-            logging.getLogger(__name__).error('Push notification error: %s', e)
+        # Invia notifica push ai partecipanti offline: accodata su Celery dopo il commit,
+        # le chiamate al notify server e ad APNs non bloccano più la risposta
+        sender_name = f"{request.user.first_name} {request.user.last_name}".strip() or request.user.username
+        if conv_type == 'group':
+            # Il nome del gruppo serve solo qui: letto on demand, senza caricare la Conversation
+            push_title = Group.objects.filter(
+                conversation_id=conversation_id,
+            ).values_list('name', flat=True).first() or 'Gruppo'
+            push_body = f"{sender_name}: Nuovo messaggio"
+        else:
+            push_title = sender_name
+            push_body = "Nuovo messaggio"
+        push_data = {
+            'conversation_id': str(conversation_id),
+            'message_type': message_type or 'text',
+        }
+        push_args = (str(conversation_id), request.user.id, push_title, push_body, push_data)
+        transaction.on_commit(lambda: _enqueue_message_push(push_args))
 
         serializer = MessageSerializer(message, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -601,13 +666,17 @@ class MarkAsReadView(APIView):
         ).update(status='read', timestamp=timezone.now())
 
         # Create 'read' status for messages from others that don't have a status for this user
-        for msg in Message.objects.filter(
+        # (unique message+user: ignore_conflicts copre le richieste concorrenti)
+        missing_ids = Message.objects.filter(
             conversation_id=conversation_id
-        ).exclude(sender=request.user):
-            MessageStatus.objects.get_or_create(
-                message=msg, user=request.user,
-                defaults={'status': 'read'}
-            )
+        ).exclude(sender=request.user).exclude(
+            statuses__user=request.user
+        ).values_list('id', flat=True)
+        MessageStatus.objects.bulk_create(
+            [MessageStatus(message_id=mid, user=request.user, status='read') for mid in missing_ids],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
 
         return Response({'status': 'ok', 'unread_count': 0})
 
@@ -642,15 +711,12 @@ class ConversationClearView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, conversation_id):
-        try:
-            participant = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user
-            )
-            participant.cleared_at = timezone.now()
-            participant.save()
-            return Response({'cleared': True})
-        except ConversationParticipant.DoesNotExist:
+        updated = ConversationParticipant.objects.filter(
+            conversation_id=conversation_id, user=request.user
+        ).update(cleared_at=timezone.now())
+        if not updated:
             return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'cleared': True})
 
 
 class ConversationLeaveView(APIView):
@@ -658,16 +724,12 @@ class ConversationLeaveView(APIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, conversation_id):
-        try:
-            participant = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user
-            )
-            participant.is_hidden = True
-            participant.cleared_at = timezone.now()
-            participant.save()
-            return Response({'hidden': True}, status=status.HTTP_200_OK)
-        except ConversationParticipant.DoesNotExist:
+        updated = ConversationParticipant.objects.filter(
+            conversation_id=conversation_id, user=request.user
+        ).update(is_hidden=True, cleared_at=timezone.now())
+        if not updated:
             return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'hidden': True}, status=status.HTTP_200_OK)
 
 
 class ConversationDeleteForAllView(APIView):
@@ -676,14 +738,12 @@ class ConversationDeleteForAllView(APIView):
 
     def delete(self, request, conversation_id):
         try:
-            participant = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user
-            )
+            participant = ConversationParticipant.objects.select_related('conversation').only(
+                'id', 'conversation'
+            ).get(conversation_id=conversation_id, user=request.user)
             # Notifica tutti i partecipanti prima di eliminare
-            channel_layer = get_channel_layer()
-            room_group_name = f'conv_{conversation_id}'
-            async_to_sync(channel_layer.group_send)(
-                room_group_name,
+            _ws_broadcast(
+                f'conv_{conversation_id}',
                 {
                     'type': 'conversation.deleted',
                     'conversation_id': str(conversation_id),
@@ -703,12 +763,13 @@ class ConversationAvatarView(APIView):
     parser_classes = [MultiPartParser]
 
     def post(self, request, conversation_id):
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-        except Conversation.DoesNotExist:
-            return Response({'error': 'Conversazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
-
-        if not ConversationParticipant.objects.filter(conversation=conversation, user=request.user).exists():
+        # Partecipazione, conversazione e gruppo in una sola query
+        participant = ConversationParticipant.objects.select_related(
+            'conversation__group_info'
+        ).filter(conversation_id=conversation_id, user=request.user).first()
+        if participant is None:
+            if not Conversation.objects.filter(id=conversation_id).exists():
+                return Response({'error': 'Conversazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
             return Response({'error': 'Non sei partecipante'}, status=status.HTTP_403_FORBIDDEN)
 
         avatar_file = request.FILES.get('avatar')
@@ -716,7 +777,7 @@ class ConversationAvatarView(APIView):
             return Response({'error': 'Nessun file fornito'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            group = conversation.group_info
+            group = participant.conversation.group_info
         except Group.DoesNotExist:
             return Response({'error': 'Non è un gruppo'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -727,59 +788,144 @@ class ConversationAvatarView(APIView):
         return Response({'avatar': avatar_url}, status=status.HTTP_200_OK)
 
 
+_MEDIA_CONTENT_TYPES = MappingProxyType({
+    '.mp4': 'video/mp4', '.mov': 'video/quicktime', '.avi': 'video/x-msvideo',
+    '.ogg': 'video/ogg', '.ogv': 'video/ogg', '.webm': 'video/webm',
+    '.mp3': 'audio/mpeg', '.wav': 'audio/wav', '.wave': 'audio/wav',
+    '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+    '.gif': 'image/gif', '.webp': 'image/webp', '.pdf': 'application/pdf',
+})
+
+
+@functools.lru_cache(maxsize=256)
+def _media_content_type(ext):
+    """
+    Content-Type per estensione. Oltre alla tabella, mimetypes copre gli altri
+    audio/video/immagini (.m4a, .heic, .mkv...); tutto il resto (html, svg, js)
+    resta application/octet-stream per non essere interpretato dal browser.
+    """
+    content_type = _MEDIA_CONTENT_TYPES.get(ext)
+    if content_type:
+        return content_type
+    guessed = mimetypes.guess_type('media' + ext)[0]
+    if guessed and guessed.startswith(('audio/', 'video/', 'image/')) and guessed != 'image/svg+xml':
+        return guessed
+    return 'application/octet-stream'
+
+
+def _accel_redirect(full_path, content_type):
+    """
+    Risposta vuota con X-Accel-Redirect: nginx serve il file da MEDIA_ROOT
+    (sendfile, range request inclusi) senza passare i byte da Django.
+    """
+    relative = os.path.relpath(full_path, MEDIA_ROOT_REAL)
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(relative)
+    return response
+
+
+class _LimitedReader:
+    """File aperto posizionato su start che restituisce al massimo length byte."""
+
+    def __init__(self, f, length):
+        self._f = f
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+
 class MediaServeView(APIView):
     """Serve media files with range request support for iOS video streaming."""
     permission_classes = [IsAuthenticated]
 
     def get(self, request, file_path):
-        # Prevent path traversal
-        if '..' in file_path or file_path.startswith('/'):
-            return Response({'error': 'File non trovato.'}, status=status.HTTP_404_NOT_FOUND)
-        full_path = os.path.join(settings.MEDIA_ROOT, file_path)
-        full_path = os.path.normpath(full_path)
-        media_root = os.path.realpath(settings.MEDIA_ROOT)
-        if not os.path.realpath(full_path).startswith(media_root):
+        # '..' e path assoluti sono già esclusi dal converter <mpath:>;
+        # il controllo su realpath resta per i symlink (con separatore: /media non copre /mediastore)
+        full_path = os.path.realpath(os.path.join(MEDIA_ROOT_REAL, file_path))
+        if not full_path.startswith(MEDIA_ROOT_REAL + os.sep):
             return Response({'error': 'File non trovato.'}, status=status.HTTP_404_NOT_FOUND)
-        if not os.path.exists(full_path) or not os.path.isfile(full_path):
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
             return Response({'error': 'File non trovato.'}, status=status.HTTP_404_NOT_FOUND)
 
-        file_size = os.path.getsize(full_path)
         content_type = self._get_content_type(full_path)
+        if settings.MEDIA_ACCEL_REDIRECT:
+            response = _accel_redirect(full_path, content_type)
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+        # Validatori da mtime+size: il client che ha già il file (o il segmento) riceve 304
+        file_size = st.st_size
+        last_modified = int(st.st_mtime)
+        etag = f'"{last_modified}-{file_size}"'
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return self._with_validators(not_modified, etag, last_modified)
 
         range_header = request.META.get('HTTP_RANGE', '')
+        # If-Range non più valido: il file è cambiato, si risponde 200 con il file intero
+        if range_header and not self._if_range_matches(request, etag, last_modified):
+            range_header = ''
         if range_header:
-            range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            range_match = RANGE_RE.match(range_header)
             if range_match:
                 start = int(range_match.group(1))
                 end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
                 end = min(end, file_size - 1)
+                if start > end:
+                    response = HttpResponse(status=416)
+                    response['Content-Range'] = f'bytes */{file_size}'
+                    return response
                 length = end - start + 1
 
-                with open(full_path, 'rb') as f:
-                    f.seek(start)
-                    data = f.read(length)
-
-                response = HttpResponse(data, status=206, content_type=content_type)
+                # Fallback senza nginx: il range viene letto a blocchi, mai tutto in memoria
+                f = open(full_path, 'rb')
+                f.seek(start)
+                response = FileResponse(_LimitedReader(f, length), status=206, content_type=content_type)
+                response.block_size = 64 * 1024
                 response['Content-Length'] = str(length)
                 response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
                 response['Accept-Ranges'] = 'bytes'
-                return response
+                return self._with_validators(response, etag, last_modified)
 
         response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response.block_size = 64 * 1024
         response['Content-Length'] = str(file_size)
         response['Accept-Ranges'] = 'bytes'
+        return self._with_validators(response, etag, last_modified)
+
+    @staticmethod
+    def _with_validators(response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, max-age=3600'
         return response
 
+    @staticmethod
+    def _if_range_matches(request, etag, last_modified):
+        """If-Range assente, oppure ETag/data che corrispondono esattamente al file attuale."""
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith(('"', 'W/')):
+            return if_range == etag
+        return parse_http_date_safe(if_range) == last_modified
+
     def _get_content_type(self, path):
-        ext = os.path.splitext(path)[1].lower()
-        types = {
-            '.mp4': 'video/mp4', '.mov': 'video/quicktime', '.avi': 'video/x-msvideo',
-            '.ogg': 'video/ogg', '.ogv': 'video/ogg', '.webm': 'video/webm',
-            '.mp3': 'audio/mpeg', '.wav': 'audio/wav', '.wave': 'audio/wav',
-            '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
-            '.gif': 'image/gif', '.webp': 'image/webp', '.pdf': 'application/pdf',
-        }
-        return types.get(ext, 'application/octet-stream')
+        return _media_content_type(os.path.splitext(path)[1].lower())
 
 
 class OfficeConvertView(APIView):
@@ -811,38 +957,47 @@ class OfficeConvertView(APIView):
         if not os.path.exists(original_path):
             return JsonResponse({'error': 'File not found'}, status=404)
 
-        pdf_path = original_path.rsplit('.', 1)[0] + '_converted.pdf'
+        pdf_path = converted_pdf_path(original_path)
 
         if not os.path.exists(pdf_path):
-            try:
-                output_dir = os.path.dirname(original_path)
-                result = subprocess.run(
-                    [
-                        'libreoffice', '--headless', '--convert-to', 'pdf',
-                        '--outdir', output_dir, original_path,
-                    ],
-                    capture_output=True,
-                    timeout=30,
-                )
-                # LibreOffice genera file con stesso nome ma .pdf
-                generated_pdf = original_path.rsplit('.', 1)[0] + '.pdf'
-                if os.path.exists(generated_pdf) and generated_pdf != pdf_path:
-                    os.rename(generated_pdf, pdf_path)
-                if not os.path.exists(pdf_path):
-                    return JsonResponse(
-                        {'error': 'Conversion failed', 'stderr': (result.stderr or b'').decode('utf-8', errors='ignore')},
-                        status=500,
-                    )
-            except subprocess.TimeoutExpired:
-                return JsonResponse({'error': 'Conversion timeout'}, status=500)
-            except Exception as e:
-                return JsonResponse({'error': str(e)}, status=500)
+            from django.core.cache import cache
+            error_key = OFFICE_CONVERT_ERROR.format(attachment_id)
+            # Conversione su Celery: una sola per allegato anche con richieste concorrenti;
+            # l'esito di un tentativo fallito viene restituito una volta e poi si riprova
+            if cache.get(error_key) is None and cache.add(
+                OFFICE_CONVERT_LOCK.format(attachment_id), True, OFFICE_CONVERT_TIMEOUT * 2,
+            ):
+                try:
+                    convert_attachment_to_pdf.delay(str(attachment_id), original_path)
+                except Exception as e:
+                    logger.error('Office convert enqueue error, conversione diretta: %s', e)
+                    convert_attachment_to_pdf.apply(args=(str(attachment_id), original_path))
+            if not os.path.exists(pdf_path):
+                error = cache.get(error_key)
+                if error is not None:
+                    cache.delete(error_key)
+                    return JsonResponse(error, status=500)
+                response = JsonResponse({'status': 'converting'}, status=202)
+                response['Retry-After'] = '2'
+                return response
 
-        response = FileResponse(open(pdf_path, 'rb'), content_type='application/pdf')
+        if settings.MEDIA_ACCEL_REDIRECT:
+            response = _accel_redirect(os.path.realpath(pdf_path), 'application/pdf')
+        else:
+            response = FileResponse(open(pdf_path, 'rb'), content_type='application/pdf')
         response['Content-Disposition'] = f'inline; filename="{os.path.basename(pdf_path)}"'
         return response
 
 
+def _enqueue_finalize_attachment(finalize_args):
+    """Accoda thumbnail + broadcast dell'allegato; se il broker non risponde li esegue in linea."""
+    try:
+        finalize_attachment.delay(*finalize_args)
+    except Exception as e:
+        logger.error('Finalize attachment enqueue error, esecuzione diretta: %s', e)
+        finalize_attachment.apply(args=finalize_args)
+
+
 class AttachmentUploadView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
@@ -886,28 +1041,15 @@ class AttachmentUploadView(APIView):
         except Message.DoesNotExist:
             return Response({'error': 'Messaggio non trovato.'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Create thumbnail for images/videos
-        thumbnail = None
+        # Dimensioni dall'header dell'immagine (nessuna decodifica dei pixel);
+        # thumbnail e broadcast WebSocket vanno su Celery dopo la risposta
         width = height = None
         duration = None
 
         if file_type == 'image':
             try:
                 from PIL import Image
-                from io import BytesIO
-                from django.core.files.uploadedfile import InMemoryUploadedFile
-                import sys
-
-                img = Image.open(file)
-                width, height = img.size
-                img.thumbnail((300, 300), Image.LANCZOS)
-                thumb_io = BytesIO()
-                img.save(thumb_io, format='JPEG', quality=70)
-                thumb_io.seek(0)
-                thumbnail = InMemoryUploadedFile(
-                    thumb_io, 'thumbnail', f'thumb_{file.name}.jpg',
-                    'image/jpeg', sys.getsizeof(thumb_io), None
-                )
+                width, height = Image.open(file).size
                 file.seek(0)  # Reset file pointer
             except Exception:
                 pass
@@ -918,43 +1060,49 @@ class AttachmentUploadView(APIView):
             file_name=file.name,
             file_size=file.size,
             mime_type=file.content_type or 'application/octet-stream',
-            thumbnail=thumbnail,
+            thumbnail=None,
             width=width,
             height=height,
             duration=duration,
         )
 
-        # Broadcast WebSocket: messaggio ora ha l'allegato, notifica i partecipanti
-        try:
-            message.refresh_from_db()
-            message_data = MessageSerializer(message, context={'request': request}).data
-            channel_layer = get_channel_layer()
-            if channel_layer:
-                conv_group = f'conv_{message.conversation_id}'
-                async_to_sync(channel_layer.group_send)(conv_group, {
-                    'type': 'chat.message',
-                    'message': message_data,
-                    'sender_id': request.user.id,
-                })
-        except Exception as e:
-            import logging
-            logging.getLogger(__name__).error(f'WS broadcast error (upload): {e}')
+        finalize_args = (str(attachment.id), request.user.id, file_type == 'image')
+        transaction.on_commit(lambda: _enqueue_finalize_attachment(finalize_args))
 
         serializer = AttachmentSerializer(attachment, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class LockPinThrottle(UserRateThrottle):
+    """Ogni richiesta calcola un hash Argon2: limite per utente contro brute force e consumo di CPU."""
+    scope = 'lock_pin'
+    rate = '5/min'
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        return super().allow_request(request, view)
+
+
+class ChatLockThrottle(LockPinThrottle):
+    scope = 'chat_lock'
+
+
+LOCK_PIN_RE = re.compile(r'\d{6,12}')
+
+
 class LockPinView(APIView):
     """PIN di sblocco per chat con lucchetto (per-utente)."""
     permission_classes = [IsAuthenticated]
+    throttle_classes = [LockPinThrottle]
 
     def post(self, request):
         """Imposta o cambia il PIN di sblocco."""
-        from django.contrib.auth.hashers import make_password
         pin = request.data.get('pin', '')
-        if len(str(pin)) < 6:
+        # Controllo O(1) prima dell'hash: solo cifre, 6-12
+        if not LOCK_PIN_RE.fullmatch(str(pin)):
             return Response(
-                {'error': 'PIN deve essere di almeno 6 cifre.'},
+                {'error': 'PIN deve essere di 6-12 cifre.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
         request.user.lock_pin = make_password(str(pin))
@@ -963,14 +1111,17 @@ class LockPinView(APIView):
 
     def put(self, request):
         """Verifica PIN esistente."""
-        from django.contrib.auth.hashers import check_password
         pin = request.data.get('pin', '')
         if not request.user.lock_pin:
             return Response(
                 {'valid': False, 'error': 'Nessun PIN impostato.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        valid = check_password(str(pin), request.user.lock_pin)
+        def upgrade(raw_pin):
+            # PIN PBKDF2 esistente: riscritto con l'hasher preferito (Argon2id)
+            request.user.lock_pin = make_password(raw_pin)
+            request.user.save(update_fields=['lock_pin'])
+        valid = check_password(str(pin), request.user.lock_pin, setter=upgrade)
         return Response({'valid': valid})
 
     def get(self, request):
@@ -978,20 +1129,28 @@ class LockPinView(APIView):
         return Response({'has_pin': bool(request.user.lock_pin)})
 
 
+def _toggle_participant_flag(request, conversation_id, field):
+    """
+    Inverte un flag booleano del partecipante con un UPDATE atomico
+    (SET field = NOT field), senza read-modify-write. MySQL non ha RETURNING:
+    il nuovo valore si rilegge nella stessa transazione.
+    """
+    participant = ConversationParticipant.objects.filter(
+        conversation_id=conversation_id, user=request.user
+    )
+    with transaction.atomic():
+        if not participant.update(**{field: ~F(field)}):
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        value = participant.values_list(field, flat=True).first()
+    return Response({field: value})
+
+
 class ConversationLockView(APIView):
     """Attiva/disattiva lucchetto su una chat (per-participant)."""
     permission_classes = [IsAuthenticated]
 
     def post(self, request, conversation_id):
-        try:
-            participant = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user
-            )
-            participant.is_locked = not participant.is_locked
-            participant.save(update_fields=['is_locked'])
-            return Response({'is_locked': participant.is_locked})
-        except ConversationParticipant.DoesNotExist:
-            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        return _toggle_participant_flag(request, conversation_id, 'is_locked')
 
 
 class ConversationFavoriteView(APIView):
@@ -999,19 +1158,32 @@ class ConversationFavoriteView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, conversation_id):
-        try:
-            participant = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user
-            )
-            participant.is_favorite = not participant.is_favorite
-            participant.save(update_fields=['is_favorite'])
-            return Response({'is_favorite': participant.is_favorite})
-        except ConversationParticipant.DoesNotExist:
-            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        return _toggle_participant_flag(request, conversation_id, 'is_favorite')
+
+
+def _check_lock_hash(pin, conversation):
+    """
+    Verifica il PIN di una chat bloccata. Gli hash bcrypt "nudi" ($2b$...)
+    salvati prima di Argon2 vengono riscritti con make_password() al primo
+    sblocco riuscito.
+    """
+    lock_hash = conversation.lock_hash
+    if lock_hash.startswith('$2'):
+        if not bcrypt.checkpw(pin.encode(), lock_hash.encode()):
+            return False
+        conversation.lock_hash = make_password(pin)
+        conversation.save(update_fields=['lock_hash'])
+        return True
+
+    def upgrade(raw_pin):
+        conversation.lock_hash = make_password(raw_pin)
+        conversation.save(update_fields=['lock_hash'])
+    return check_password(pin, lock_hash, setter=upgrade)
 
 
 class LockChatView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ChatLockThrottle]
 
     def post(self, request, conversation_id):
         """Lock a conversation with a PIN"""
@@ -1026,8 +1198,8 @@ class LockChatView(APIView):
         except Conversation.DoesNotExist:
             return Response({'error': 'Conversazione non trovata.'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Hash the PIN
-        pin_hash = bcrypt.hashpw(pin.encode(), bcrypt.gensalt()).decode()
+        # Hash the PIN (Argon2id via PASSWORD_HASHERS)
+        pin_hash = make_password(pin)
         conversation.is_locked = True
         conversation.lock_hash = pin_hash
         conversation.conv_type = 'secret'
@@ -1038,6 +1210,7 @@ class LockChatView(APIView):
 
 class UnlockChatView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ChatLockThrottle]
 
     def post(self, request, conversation_id):
         """Unlock a locked conversation"""
@@ -1053,12 +1226,22 @@ class UnlockChatView(APIView):
         if not conversation.is_locked:
             return Response({'message': 'Chat non bloccata.'})
 
-        if bcrypt.checkpw(pin.encode(), conversation.lock_hash.encode()):
+        if _check_lock_hash(pin, conversation):
             return Response({'unlocked': True})
         else:
             return Response({'error': 'PIN errato.'}, status=status.HTTP_403_FORBIDDEN)
 
 
+def _created_message(message_id):
+    """
+    Rilegge un messaggio appena creato con le relazioni del MessageSerializer:
+    una join per le one-to-one al posto delle query lazy, valori normalizzati dal DB.
+    """
+    return Message.objects.select_related(
+        'sender', 'location', 'shared_contact', 'calendar_event',
+    ).prefetch_related('attachments', 'statuses', 'reactions').get(id=message_id)
+
+
 class LocationShareView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -1073,33 +1256,41 @@ class LocationShareView(APIView):
             return Response({'error': 'Coordinate mancanti.'}, status=status.HTTP_400_BAD_REQUEST)
 
         msg_type = 'location_live' if duration_minutes > 0 else 'location'
-        message = Message.objects.create(
-            conversation_id=conversation_id,
-            sender=request.user,
-            message_type=msg_type,
-        )
-
         live_until = None
         if duration_minutes > 0:
             live_until = timezone.now() + timedelta(minutes=duration_minutes)
 
-        LocationShare.objects.create(
-            message=message,
-            latitude=lat,
-            longitude=lng,
-            address=address,
-            is_live=duration_minutes > 0,
-            live_until=live_until,
-        )
-
-        Conversation.objects.filter(id=conversation_id).update(
-            last_message=message, updated_at=timezone.now()
-        )
+        with transaction.atomic():
+            message = Message.objects.create(
+                conversation_id=conversation_id,
+                sender=request.user,
+                message_type=msg_type,
+            )
+            LocationShare.objects.create(
+                message=message,
+                latitude=lat,
+                longitude=lng,
+                address=address,
+                is_live=duration_minutes > 0,
+                live_until=live_until,
+            )
+            Conversation.objects.filter(id=conversation_id).update(
+                last_message=message, updated_at=timezone.now()
+            )
 
-        serializer = MessageSerializer(message, context={'request': request})
+        serializer = MessageSerializer(_created_message(message.id), context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+def _enqueue_build_event_ics(event_id):
+    """Accoda la generazione del .ics; se il broker non risponde la esegue in linea."""
+    try:
+        build_event_ics.delay(event_id)
+    except Exception as e:
+        logger.error('Event ics enqueue error, esecuzione diretta: %s', e)
+        build_event_ics.apply(args=(event_id,))
+
+
 class CalendarEventView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -1114,47 +1305,27 @@ class CalendarEventView(APIView):
         if not title or not start or not end:
             return Response({'error': 'Titolo e date obbligatori.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        message = Message.objects.create(
-            conversation_id=conversation_id,
-            sender=request.user,
-            message_type='event',
-        )
-
-        event = CalendarEvent.objects.create(
-            message=message,
-            title=title,
-            description=description,
-            start_datetime=start,
-            end_datetime=end,
-            location=location,
-        )
-
-        # Generate .ics file
-        try:
-            from icalendar import Calendar, Event as ICalEvent
-            from django.core.files.base import ContentFile
-
-            cal = Calendar()
-            cal.add('prodid', '-//SecureChat//EN')
-            cal.add('version', '2.0')
-            ical_event = ICalEvent()
-            ical_event.add('summary', title)
-            ical_event.add('description', description)
-            ical_event.add('dtstart', event.start_datetime)
-            ical_event.add('dtend', event.end_datetime)
-            if location:
-                ical_event.add('location', location)
-            cal.add_component(ical_event)
-            ics_content = cal.to_ical()
-            event.ics_file.save(f'event_{event.id}.ics', ContentFile(ics_content))
-        except Exception:
-            pass
-
-        Conversation.objects.filter(id=conversation_id).update(
-            last_message=message, updated_at=timezone.now()
-        )
+        with transaction.atomic():
+            message = Message.objects.create(
+                conversation_id=conversation_id,
+                sender=request.user,
+                message_type='event',
+            )
+            event = CalendarEvent.objects.create(
+                message=message,
+                title=title,
+                description=description,
+                start_datetime=start,
+                end_datetime=end,
+                location=location,
+            )
+            Conversation.objects.filter(id=conversation_id).update(
+                last_message=message, updated_at=timezone.now()
+            )
+            # File .ics generato da Celery (storage fuori dal percorso della risposta)
+            transaction.on_commit(lambda: _enqueue_build_event_ics(event.id))
 
-        serializer = MessageSerializer(message, context={'request': request})
+        serializer = MessageSerializer(_created_message(message.id), context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -1167,40 +1338,50 @@ class ReactionView(APIView):
         if not emoji:
             return Response({'error': 'Emoji mancante.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            message = Message.objects.get(id=message_id)
-        except Message.DoesNotExist:
+        # Serve solo la conversazione per il broadcast, non la riga del messaggio
+        conversation_id = Message.objects.filter(id=message_id).values_list(
+            'conversation_id', flat=True
+        ).first()
+        if conversation_id is None:
             return Response({'error': 'Messaggio non trovato.'}, status=status.HTTP_404_NOT_FOUND)
 
-        MessageReaction.objects.update_or_create(
-            message=message, user=request.user,
-            defaults={'emoji': emoji}
+        # Upsert in un solo statement sull'unique (message, user):
+        # ON DUPLICATE KEY UPDATE su MySQL, ON CONFLICT altrove
+        MessageReaction.objects.bulk_create(
+            [MessageReaction(message_id=message_id, user=request.user, emoji=emoji)],
+            update_conflicts=True,
+            unique_fields=(
+                ['message', 'user']
+                if connection.features.supports_update_conflicts_with_target else None
+            ),
+            update_fields=['emoji'],
         )
         # Broadcast via WebSocket
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"conv_{message.conversation_id}",
-            {"type": "message.reaction", "message_id": str(message.id), "emoji": emoji, "user_id": request.user.id, "username": request.user.username, "action": "add"}
+        _ws_broadcast(
+            f"conv_{conversation_id}",
+            {"type": "message.reaction", "message_id": str(message_id), "emoji": emoji, "user_id": request.user.id, "username": request.user.username, "action": "add"}
         )
         return Response({'message': 'Reazione aggiunta.'})
 
     def delete(self, request, message_id):
         """Remove a reaction"""
-        msg = Message.objects.filter(id=message_id).first()
+        conversation_id = Message.objects.filter(id=message_id).values_list(
+            'conversation_id', flat=True
+        ).first()
         MessageReaction.objects.filter(message_id=message_id, user=request.user).delete()
-        if msg:
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"conv_{msg.conversation_id}",
+        if conversation_id:
+            _ws_broadcast(
+                f"conv_{conversation_id}",
                 {"type": "message.reaction", "message_id": str(message_id), "emoji": "", "user_id": request.user.id, "username": request.user.username, "action": "remove"}
             )
         return Response({'message': 'Reazione rimossa.'})
 
 
+LINK_PREVIEW_TIMEOUT = 5
+LINK_PREVIEW_MAX_BYTES = 256 * 1024
+LINK_PREVIEW_ERROR_TTL = 60  # fetch fallito: stesso errore a tutti per un minuto
+
+
 class LinkPreviewView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -1214,23 +1395,36 @@ class LinkPreviewView(APIView):
         cache_key = f'link_preview:{url}'
         cached = cache.get(cache_key)
         if cached:
-            return Response(cached)
+            return self._cached_response(cached)
+
+        # Un solo fetch per URL anche con molte richieste concorrenti (link virale):
+        # chi non prende il lock non aspetta il fetch, riceve subito un'anteprima
+        # vuota (202) e la richiede più tardi
+        lock_key = f'{cache_key}:lock'
+        if not cache.add(lock_key, True, LINK_PREVIEW_TIMEOUT * 2):
+            cached = cache.get(cache_key)
+            if cached:
+                return self._cached_response(cached)
+            return Response(self._empty_preview(url), status=status.HTTP_202_ACCEPTED)
 
         try:
-            import requests as http_requests
+            import httpx
             from bs4 import BeautifulSoup
 
             headers = {'User-Agent': 'SecureChat/1.0 LinkPreview'}
-            resp = http_requests.get(url, headers=headers, timeout=5, allow_redirects=True)
-            soup = BeautifulSoup(resp.text, 'html.parser')
-
-            preview = {
-                'url': url,
-                'title': '',
-                'description': '',
-                'image': '',
-                'site_name': '',
-            }
+            # I meta OG stanno nell'<head>: si smette di leggere a </head> o dopo 256 KB.
+            # Si cerca solo nel chunk nuovo più 6 byte del precedente (tag a cavallo)
+            html = bytearray()
+            with httpx.stream('GET', url, headers=headers, timeout=LINK_PREVIEW_TIMEOUT, follow_redirects=True) as resp:
+                encoding = resp.charset_encoding
+                for chunk in resp.iter_bytes(8192):
+                    start = max(len(html) - 6, 0)
+                    html += chunk
+                    if b'</head>' in html[start:].lower() or len(html) > LINK_PREVIEW_MAX_BYTES:
+                        break
+            soup = BeautifulSoup(bytes(html), 'lxml', from_encoding=encoding)
+
+            preview = self._empty_preview(url)
 
             # Open Graph tags
             for prop in ['title', 'description', 'image', 'site_name']:
@@ -1253,8 +1447,21 @@ class LinkPreviewView(APIView):
             return Response(preview)
 
         except Exception as e:
-            return Response({'error': 'Impossibile generare anteprima.'},
-                          status=status.HTTP_400_BAD_REQUEST)
+            error = {'error': 'Impossibile generare anteprima.'}
+            cache.set(cache_key, error, LINK_PREVIEW_ERROR_TTL)
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            cache.delete(lock_key)
+
+    @staticmethod
+    def _empty_preview(url):
+        return {'url': url, 'title': '', 'description': '', 'image': '', 'site_name': ''}
+
+    @staticmethod
+    def _cached_response(cached):
+        if 'error' in cached:
+            return Response(cached, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cached)
 
 
 class SearchMessagesView(APIView):
@@ -1277,7 +1484,13 @@ class SearchMessagesView(APIView):
             conversation_id=conversation_id,
             content_for_translation__icontains=query,
             is_deleted=False,
-        ).select_related('sender').order_by('-created_at')[:50]
+        ).select_related('sender').only(
+            *_only_public_user(Message, 'sender'),
+        ).prefetch_related(
+            'attachments', 'statuses', 'reactions',
+            'location', 'shared_contact', 'calendar_event',
+            _reply_to_prefetch(),
+        ).order_by('-created_at')[:50]
 
         serializer = MessageSerializer(messages, many=True, context={'request': request})
         return Response(serializer.data)
@@ -1321,28 +1534,24 @@ class StoryCreateView(APIView):
 class StoryFeedView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @method_decorator(POLL_CACHE)
     def get(self, request):
         """Get stories from contacts (not expired)"""
+        # Privacy valutata dal DB: EXISTS sulle tabelle M2M invece di una query per storia
+        allowed = Story.allowed_users.through.objects.filter(story=OuterRef('pk'), user=request.user)
+        excluded = Story.excluded_users.through.objects.filter(story=OuterRef('pk'), user=request.user)
         stories = Story.objects.filter(
             is_active=True,
             expires_at__gt=timezone.now(),
         ).exclude(
             user=request.user
+        ).filter(
+            Q(privacy='all') |
+            Q(Exists(allowed), privacy='custom') |
+            Q(~Exists(excluded), privacy='except')
         ).select_related('user').prefetch_related('views').order_by('-created_at')
 
-        # Filter by privacy
-        visible = []
-        for story in stories:
-            if story.privacy == 'all':
-                visible.append(story)
-            elif story.privacy == 'custom':
-                if story.allowed_users.filter(id=request.user.id).exists():
-                    visible.append(story)
-            elif story.privacy == 'except':
-                if not story.excluded_users.filter(id=request.user.id).exists():
-                    visible.append(story)
-
-        serializer = StorySerializer(visible, many=True, context={'request': request})
+        serializer = StorySerializer(stories, many=True, context={'request': request})
         return Response(serializer.data)
 
 
@@ -1370,14 +1579,11 @@ class StoryViewersView(APIView):
         except Story.DoesNotExist:
             return Response({'error': 'Storia non trovata.'}, status=status.HTTP_404_NOT_FOUND)
 
-        viewers = StoryView.objects.filter(story=story).select_related('viewer').order_by('-viewed_at')
-        from accounts.serializers import UserPublicSerializer
-        data = [{
-            'user': UserPublicSerializer(v.viewer).data,
-            'viewed_at': v.viewed_at.isoformat(),
-        } for v in viewers]
-
-        return Response(data)
+        viewers = StoryView.objects.filter(story=story).select_related('viewer').only(
+            *_only_public_user(StoryView, 'viewer'),
+        ).order_by('-viewed_at')
+        serializer = StoryViewerSerializer(viewers, many=True)
+        return Response(serializer.data)
 
 
 class StoryDeleteView(APIView):
@@ -1410,43 +1616,96 @@ class CreateGroupView(APIView):
         description = serializer.validated_data.get('description', '')
         member_ids = serializer.validated_data['member_ids']
 
-        # Create conversation
-        conversation = Conversation.objects.create(conv_type='group')
+        active_ids = User.objects.filter(
+            id__in=member_ids, is_active=True,
+        ).exclude(id=request.user.id).values_list('id', flat=True)
 
-        # Add creator as admin
-        ConversationParticipant.objects.create(
-            conversation=conversation, user=request.user, role='admin'
-        )
+        # Tutto o niente: un errore a metà non lascia un gruppo senza membri o senza Group
+        with transaction.atomic():
+            conversation = Conversation.objects.create(conv_type='group')
 
-        # Add members
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        for uid in member_ids:
-            if uid != request.user.id and User.objects.filter(id=uid, is_active=True).exists():
-                ConversationParticipant.objects.create(
-                    conversation=conversation, user_id=uid, role='member'
-                )
+            # Creator (admin) + members in un solo INSERT
+            ConversationParticipant.objects.bulk_create(
+                [ConversationParticipant(conversation=conversation, user=request.user, role='admin')]
+                + [
+                    ConversationParticipant(conversation=conversation, user_id=uid, role='member')
+                    for uid in active_ids
+                ]
+            )
 
-        # Create group info
-        invite_code = uuid.uuid4().hex[:12]
-        Group.objects.create(
-            conversation=conversation,
-            name=name,
-            description=description,
-            created_by=request.user,
-            invite_link=invite_code,
-        )
+            # Codice casuale: una collisione sull'unique di invite_link è
+            # rarissima, ma in quel caso si riprova con un altro codice
+            for attempt in range(Group.INVITE_CODE_ATTEMPTS):
+                try:
+                    with transaction.atomic():
+                        Group.objects.create(
+                            conversation=conversation,
+                            name=name,
+                            description=description,
+                            created_by=request.user,
+                            invite_link=Group.new_invite_code(),
+                        )
+                    break
+                except IntegrityError:
+                    if attempt == Group.INVITE_CODE_ATTEMPTS - 1:
+                        raise
+
+            # System message
+            Message.objects.create(
+                conversation=conversation,
+                sender=request.user,
+                message_type='system',
+                content_for_translation=f'{request.user.first_name} ha creato il gruppo "{name}"',
+            )
 
-        # System message
-        Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            message_type='system',
-            content_for_translation=f'{request.user.first_name} ha creato il gruppo "{name}"',
-        )
+        # Conversazione completa solo su richiesta (?full=1): di norma al client
+        # basta l'id del gruppo appena creato
+        if request.query_params.get('full'):
+            data = ConversationDetailSerializer(conversation, context={'request': request}).data
+        else:
+            data = {'id': str(conversation.id), 'name': name}
+        return Response(data, status=status.HTTP_201_CREATED)
 
-        serializer = ConversationDetailSerializer(conversation, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+def _add_member(conversation_id, user):
+    """
+    Aggiunge user come membro; False se partecipa già. INSERT diretto sull'unique
+    (conversation, user) invece di get_or_create: niente SELECT preliminare e
+    nessuna finestra di race tra lettura e scrittura.
+    """
+    try:
+        with transaction.atomic():
+            ConversationParticipant.objects.create(
+                conversation_id=conversation_id, user=user, role='member',
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def _enqueue_system_message(conversation_id, sender_id, text):
+    """
+    Accoda il messaggio di sistema dopo il commit della modifica ai membri; se il
+    broker non risponde lo crea in linea.
+    """
+    def enqueue():
+        try:
+            create_system_message.delay(conversation_id, sender_id, text)
+        except Exception as e:
+            logger.error('System message enqueue error, esecuzione diretta: %s', e)
+            create_system_message.apply(args=(conversation_id, sender_id, text))
+    transaction.on_commit(enqueue)
+
+
+def _at_capacity(conversation_id, cap):
+    """
+    True se la conversazione ha già almeno cap partecipanti. COUNT su una
+    subquery con LIMIT cap: la scansione dell'indice (conversation, user) si
+    ferma al limite invece di contare tutti i membri.
+    """
+    return ConversationParticipant.objects.filter(
+        conversation_id=conversation_id,
+    ).order_by().values('id')[:cap].count() >= cap
 
 
 class GroupMembersView(APIView):
@@ -1458,37 +1717,39 @@ class GroupMembersView(APIView):
         if not user_id:
             return Response({'error': 'user_id mancante.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Ruolo del chiamante, impostazioni del gruppo e numero di membri in una query
+        members = ConversationParticipant.objects.filter(
+            conversation_id=OuterRef('conversation_id'),
+        ).order_by().values('conversation_id').annotate(n=Count('id')).values('n')
         try:
-            my_part = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user
-            )
+            my_part = ConversationParticipant.objects.select_related(
+                'conversation__group_info'
+            ).annotate(
+                n_members=Subquery(members),
+            ).get(conversation_id=conversation_id, user=request.user)
         except ConversationParticipant.DoesNotExist:
             return Response({'error': 'Non sei nel gruppo.'}, status=status.HTTP_403_FORBIDDEN)
 
-        group = Group.objects.filter(conversation_id=conversation_id).first()
+        try:
+            group = my_part.conversation.group_info
+        except Group.DoesNotExist:
+            group = None
         if group and group.only_admins_can_invite and my_part.role != 'admin':
             return Response({'error': 'Solo gli admin possono invitare.'}, status=status.HTTP_403_FORBIDDEN)
 
         # Check max members
-        current_count = ConversationParticipant.objects.filter(conversation_id=conversation_id).count()
-        if group and current_count >= group.max_members:
+        if group and my_part.n_members >= group.max_members:
             return Response({'error': f'Limite membri raggiunto ({group.max_members}).'},
                           status=status.HTTP_400_BAD_REQUEST)
 
-        participant, created = ConversationParticipant.objects.get_or_create(
-            conversation_id=conversation_id, user_id=user_id,
-            defaults={'role': 'member'}
-        )
+        # Letto una volta: serve sia per il partecipante sia per il messaggio di sistema
+        new_user = User.objects.only('id', 'first_name').filter(id=user_id).first()
+        if new_user is None:
+            return Response({'error': 'Utente non trovato.'}, status=status.HTTP_404_NOT_FOUND)
 
-        if created:
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            new_user = User.objects.get(id=user_id)
-            Message.objects.create(
-                conversation_id=conversation_id,
-                sender=request.user,
-                message_type='system',
-                content_for_translation=f'{new_user.first_name} è stato aggiunto al gruppo',
+        if _add_member(conversation_id, new_user):
+            _enqueue_system_message(
+                conversation_id, request.user.id, f'{new_user.first_name} è stato aggiunto al gruppo',
             )
 
         return Response({'message': 'Membro aggiunto.'}, status=status.HTTP_201_CREATED)
@@ -1496,30 +1757,33 @@ class GroupMembersView(APIView):
     def delete(self, request, conversation_id):
         """Remove a member from group (admin only)"""
         user_id = request.data.get('user_id')
-
-        try:
-            my_part = ConversationParticipant.objects.get(
-                conversation_id=conversation_id, user=request.user, role='admin'
-            )
-        except ConversationParticipant.DoesNotExist:
-            return Response({'error': 'Solo gli admin possono rimuovere.'}, status=status.HTTP_403_FORBIDDEN)
-
-        if user_id == request.user.id:
-            return Response({'error': 'Non puoi rimuovere te stesso.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        deleted, _ = ConversationParticipant.objects.filter(
-            conversation_id=conversation_id, user_id=user_id
-        ).delete()
-
-        if deleted:
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            removed_user = User.objects.get(id=user_id)
-            Message.objects.create(
+        is_self = str(user_id) == str(request.user.id)
+
+        # Partecipante da rimuovere e nome dell'utente in una query, solo se chi
+        # chiama è admin della conversazione (stessa join di _target)
+        removed = None
+        if not is_self:
+            removed = ConversationParticipant.objects.select_related('user').only(
+                'id', 'user', 'user__first_name',
+            ).filter(
                 conversation_id=conversation_id,
-                sender=request.user,
-                message_type='system',
-                content_for_translation=f'{removed_user.first_name} è stato rimosso dal gruppo',
+                user_id=user_id,
+                conversation__conversation_participants__user=request.user,
+                conversation__conversation_participants__role='admin',
+            ).first()
+
+        if removed is None:
+            # Nessuna riga: ricostruisce l'errore (fuori dal percorso normale)
+            if not ConversationParticipant.objects.filter(
+                conversation_id=conversation_id, user=request.user, role='admin'
+            ).exists():
+                return Response({'error': 'Solo gli admin possono rimuovere.'}, status=status.HTTP_403_FORBIDDEN)
+            if is_self:
+                return Response({'error': 'Non puoi rimuovere te stesso.'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            removed.delete()
+            _enqueue_system_message(
+                conversation_id, request.user.id, f'{removed.user.first_name} è stato rimosso dal gruppo',
             )
 
         return Response({'message': 'Membro rimosso.'})
@@ -1530,33 +1794,29 @@ class GroupJoinView(APIView):
 
     def post(self, request, invite_code):
         """Join a group via invite link"""
-        try:
-            group = Group.objects.get(invite_link=invite_code)
-        except Group.DoesNotExist:
+        # Impostazioni del link dalla cache: niente SELECT su groups per ogni join
+        invite = Group.get_invite_cached(invite_code)
+        if invite is None:
             return Response({'error': 'Link non valido.'}, status=status.HTTP_404_NOT_FOUND)
 
-        if not group.is_invite_valid():
+        expires = invite['invite_link_expires']
+        if expires and timezone.now() > expires:
             return Response({'error': 'Link scaduto.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        current_count = ConversationParticipant.objects.filter(conversation=group.conversation).count()
-        if current_count >= group.max_members:
+        conversation_id = invite['conversation_id']
+        if _at_capacity(conversation_id, invite['max_members']):
             return Response({'error': 'Gruppo pieno.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        participant, created = ConversationParticipant.objects.get_or_create(
-            conversation=group.conversation, user=request.user,
-            defaults={'role': 'member'}
-        )
-
-        if created:
-            Message.objects.create(
-                conversation=group.conversation,
-                sender=request.user,
-                message_type='system',
-                content_for_translation=f'{request.user.first_name} si è unito al gruppo',
+        if _add_member(conversation_id, request.user):
+            _enqueue_system_message(
+                conversation_id, request.user.id, f'{request.user.first_name} si è unito al gruppo',
             )
 
-        serializer = ConversationDetailSerializer(group.conversation, context={'request': request})
-        return Response(serializer.data)
+        # Come CreateGroupView: conversazione completa solo con ?full=1
+        if request.query_params.get('full'):
+            conversation = Conversation.objects.get(id=conversation_id)
+            return Response(ConversationDetailSerializer(conversation, context={'request': request}).data)
+        return Response({'id': str(conversation_id), 'name': invite['name']})
 
 
 class MessageEditView(APIView):
@@ -1594,12 +1854,8 @@ class MessageEditView(APIView):
         message.save(update_fields=['content_for_translation', 'is_edited', 'edited_at', 'content_encrypted'])
 
         # Notifica via WebSocket agli altri partecipanti
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        channel_layer = get_channel_layer()
-        conv_group = f'conv_{message.conversation_id}'
-        async_to_sync(channel_layer.group_send)(
-            conv_group,
+        _ws_broadcast(
+            f'conv_{message.conversation_id}',
             {
                 'type': 'message.edited',
                 'message_id': str(message.id),
@@ -1615,3 +1871,60 @@ class MessageEditView(APIView):
             'is_edited': True,
             'edited_at': message.edited_at.isoformat(),
         })
+
+
+# ── ACTION ROUTERS ──
+
+_ACTION_VIEWS = {}
+
+
+def _action_view(view_cls):
+    """as_view() memoizzato: il callable della view viene costruito una sola volta."""
+    view = _ACTION_VIEWS.get(view_cls)
+    if view is None:
+        view = _ACTION_VIEWS[view_cls] = view_cls.as_view()
+    return view
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ActionRouterView(View):
+    """
+    Base per le route <id>/<action>/: la view di destinazione si sceglie con
+    un lookup su ACTIONS e riceve gli altri kwarg della route (conversation_id,
+    story_id, ...).
+    """
+    ACTIONS = {}
+
+    def dispatch(self, request, action, **kwargs):
+        view_cls = self.ACTIONS.get(action)
+        if view_cls is None:
+            return JsonResponse({'error': 'Not found'}, status=404)
+        return _action_view(view_cls)(request, **kwargs)
+
+
+class ConversationActionRouterView(ActionRouterView):
+    """/api/chat/conversations/<id>/<action>/ — una sola route per tutte le azioni sulla conversazione."""
+    ACTIONS = {
+        'read': MarkAsReadView,
+        'mute': ConversationMuteView,
+        'clear': ConversationClearView,
+        'leave': ConversationLeaveView,
+        'delete-for-all': ConversationDeleteForAllView,
+        'avatar': ConversationAvatarView,
+        'participants': ConversationParticipantsView,
+        'lock': ConversationLockView,
+        'favorite': ConversationFavoriteView,
+        'lock-secret': LockChatView,
+        'unlock': UnlockChatView,
+        'location': LocationShareView,
+        'event': CalendarEventView,
+        'search': SearchMessagesView,
+    }
+
+
+class StoryActionRouterView(ActionRouterView):
+    """/api/chat/stories/<id>/<action>/ — view (POST) e viewers (GET); DELETE resta su stories/<id>/."""
+    ACTIONS = {
+        'view': StoryViewRegisterView,
+        'viewers': StoryViewersView,
+    }
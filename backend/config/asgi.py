@@ -15,13 +15,20 @@ from channels_pub.routing import websocket_urlpatterns as channels_pub_ws
 
 django_asgi_app = get_asgi_application()
 
+# URLconf compilato al boot: la prima richiesta non paga import e regex
+from chat.resolvers import warm_up
+warm_up()
+
+# Rotte WebSocket di tutte le app, concatenate una sola volta all'import.
+# Nessun AllowedHostsOriginValidator: i client mobile (IOWebSocketChannel)
+# non inviano l'header Origin e verrebbero rifiutati.
+WEBSOCKET_ROUTES = tuple(chat_ws + calls_ws + channels_pub_ws)
+
 application = ProtocolTypeRouter({
     'http': django_asgi_app,
     'websocket': (
         AuthMiddlewareStack(
-            URLRouter(
-                chat_ws + calls_ws + channels_pub_ws
-            )
+            URLRouter(WEBSOCKET_ROUTES)
         )
     ),
 })
@@ -0,0 +1,45 @@
+import logging
+import logging.handlers
+import os
+import queue
+
+
+class QueuedRotatingFileHandler(logging.handlers.QueueHandler):
+    """
+    RotatingFileHandler scritto da un thread in background (QueueListener):
+    il thread che logga accoda il record e prosegue, senza attendere il disco
+    né la rotazione del file.
+
+    Il listener parte al primo record di ogni processo, così anche i figli
+    creati con fork (worker Celery prefork) hanno il proprio thread di scrittura.
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding,
+        )
+        self.listener = None
+        self._pid = None
+
+    def setFormatter(self, fmt):
+        # La formattazione finale avviene nel listener, sul file handler
+        self.target.setFormatter(fmt)
+
+    def enqueue(self, record):
+        # emit() gira sotto il lock dell'handler: un solo listener per processo
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.queue = queue.SimpleQueue()
+            self.listener = logging.handlers.QueueListener(self.queue, self.target)
+            self.listener.start()
+        super().enqueue(record)
+
+    def close(self):
+        # Svuota la coda prima di chiudere il file (logging.shutdown all'uscita)
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+        self.target.close()
+        super().close()
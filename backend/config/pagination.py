@@ -1,10 +1,14 @@
 """
 Default cursor pagination for the API.
 Uses created_at (not 'created') so models with created_at work with the global default.
+The id tie-break keeps the order total, so rows sharing a created_at are never
+skipped or repeated across pages; index (…, created_at, id) to avoid a filesort.
 """
 from rest_framework.pagination import CursorPagination
 
 
 class DefaultCursorPagination(CursorPagination):
     page_size = 50
-    ordering = '-created_at'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
@@ -1,5 +1,7 @@
 import os
+import sys
 from pathlib import Path
+from urllib.parse import urlsplit
 from datetime import timedelta
 from celery.schedules import crontab
 
@@ -28,7 +30,10 @@ DEBUG = env.bool('DEBUG', default=IS_DEVELOPMENT)
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=['localhost', '127.0.0.1', '0.0.0.0'])
 
 INSTALLED_APPS = [
-    'daphne',
+    # daphne serve solo a `runserver` (ASGI in sviluppo): la sua AppConfig importa
+    # Twisted e installa il reactor, ~0.3 s a ogni avvio di worker Celery, beat,
+    # comandi di management e test. In produzione il server è uvicorn/daphne da CLI.
+    *(['daphne'] if 'runserver' in sys.argv else []),
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -103,6 +108,11 @@ DATABASES = {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
             **( {'ssl': {'ca': env('DB_SSL_CA', default='')}} if env('DB_SSL_CA', default='') else {} ),
         },
+        # Connessioni persistenti solo dove il thread vive a lungo (worker Celery).
+        # Sotto daphne/ASGI ogni richiesta sync gira in un thread nuovo: con
+        # CONN_MAX_AGE > 0 le connessioni resterebbero aperte fino a wait_timeout.
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=0),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -116,6 +126,16 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
+# Argon2id per i nuovi hash (password, PIN); gli hash PBKDF2/bcrypt esistenti
+# restano verificabili e vengono aggiornati al primo controllo riuscito
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -148,6 +168,9 @@ SIMPLE_JWT = {
 
 # Redis — same structure for Docker and DO Managed Redis
 REDIS_URL = env('REDIS_URL', default='redis://redis:6379/0')
+# Sessioni su un DB Redis separato (0 cache, 1-2 Celery): la cache può essere
+# svuotata o sfrattata senza disconnettere gli utenti
+SESSION_REDIS_URL = env('SESSION_REDIS_URL', default=urlsplit(REDIS_URL)._replace(path='/3').geturl())
 
 CACHES = {
     'default': {
@@ -157,9 +180,23 @@ CACHES = {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
             **({'CONNECTION_POOL_KWARGS': {'ssl_cert_reqs': None}} if REDIS_URL.startswith('rediss://') else {}),
         },
-    }
+    },
+    'sessions': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': SESSION_REDIS_URL,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 2,
+            'SOCKET_TIMEOUT': 2,
+            **({'CONNECTION_POOL_KWARGS': {'ssl_cert_reqs': None}} if SESSION_REDIS_URL.startswith('rediss://') else {}),
+        },
+    },
 }
 
+# Cifratura Fernet dei messaggi del channel layer. Con Redis raggiungibile solo
+# dalla rete privata (TLS rediss:// o VPC) si può disattivare per risparmiare CPU.
+CHANNELS_ENCRYPT = env.bool('CHANNELS_ENCRYPT', default=IS_PRODUCTION)
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -167,14 +204,14 @@ CHANNEL_LAYERS = {
             'hosts': [REDIS_URL],
             'capacity': 1500,
             'expiry': 10,
-            **({'symmetric_encryption_keys': [SECRET_KEY]} if IS_PRODUCTION else {}),
+            **({'symmetric_encryption_keys': [SECRET_KEY]} if CHANNELS_ENCRYPT else {}),
         },
     },
 }
 
 # Session
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
-SESSION_CACHE_ALIAS = 'default'
+SESSION_CACHE_ALIAS = 'sessions'
 
 # Celery
 CELERY_BROKER_URL = env('CELERY_BROKER_URL', default=REDIS_URL)
@@ -185,6 +222,13 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# Thumbnail degli allegati su una coda dedicata solo se configurata (docker-compose:
+# worker celery_thumbnails). Vuota = coda di default, servita da ogni worker
+# (es. supervisor sul Droplet)
+CELERY_THUMBNAILS_QUEUE = env('CELERY_THUMBNAILS_QUEUE', default='')
+CELERY_TASK_ROUTES = {
+    'chat.finalize_attachment': {'queue': CELERY_THUMBNAILS_QUEUE},
+} if CELERY_THUMBNAILS_QUEUE else {}
 # When using DatabaseScheduler, add these in Django Admin (Periodic Tasks).
 # When using default beat scheduler, this schedule applies:
 CELERY_BEAT_SCHEDULE = {
@@ -243,6 +287,12 @@ else:
     MEDIA_URL = '/media/'
     MEDIA_ROOT = BASE_DIR / 'media'
 
+# X-Accel-Redirect: MediaServeView/OfficeConvertView fanno solo i controlli di accesso
+# e lasciano a nginx l'invio del file (location internal /internal-media/).
+# Lasciare False quando Django non è dietro nginx (runserver, test).
+MEDIA_ACCEL_REDIRECT = env.bool('MEDIA_ACCEL_REDIRECT', default=False)
+MEDIA_ACCEL_PREFIX = '/internal-media/'
+
 STATICFILES_DIRS = [BASE_DIR / 'static'] if (BASE_DIR / 'static').exists() else []
 
 # File upload
@@ -303,7 +353,9 @@ LOGGING = {
             'formatter': 'verbose' if IS_PRODUCTION else 'simple',
         },
         'file': {
-            'class': 'logging.handlers.RotatingFileHandler',
+            # RotatingFileHandler dietro una coda: la scrittura su disco avviene
+            # in un thread separato, fuori dal percorso della richiesta
+            '()': 'config.log_handlers.QueuedRotatingFileHandler',
             'filename': BASE_DIR / 'logs' / 'securechat.log',
             'maxBytes': 10 * 1024 * 1024,
             'backupCount': 5,
@@ -5,29 +5,42 @@ from django.conf.urls.static import static
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from concurrent.futures import ThreadPoolExecutor
 from django.db import connection
-from django.core.cache import cache
 
-@api_view(['GET'])
-@permission_classes([AllowAny])
-def health_check(request):
-    # Check DB
-    db_ok = False
+# Thread per la sonda Redis: gira mentre la richiesta esegue quella sul DB
+_HEALTH_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='health')
+
+
+def _check_db():
     try:
         with connection.cursor() as cursor:
             cursor.execute("SELECT 1")
-        db_ok = True
+        return True
     except Exception:
-        pass
+        return False
+
 
-    # Check Redis
-    redis_ok = False
+def _check_redis():
+    # SET + GET in una sola round trip
     try:
-        cache.set('health_check', 'ok', 10)
-        if cache.get('health_check') == 'ok':
-            redis_ok = True
+        from django_redis import get_redis_connection
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.set('health_check', 'ok', ex=10)
+        pipe.get('health_check')
+        return pipe.execute()[1] == b'ok'
     except Exception:
-        pass
+        return False
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def health_check(request):
+    # Redis in parallelo; il DB resta sul thread della richiesta, che ne
+    # gestisce la connessione (nessuna connessione aperta nei thread del pool)
+    redis_future = _HEALTH_POOL.submit(_check_redis)
+    db_ok = _check_db()
+    redis_ok = redis_future.result()
 
     status_code = 200 if (db_ok and redis_ok) else 503
     return Response({
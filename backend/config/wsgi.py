@@ -2,3 +2,6 @@ import os
 from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.dev')
 application = get_wsgi_application()
+
+from chat.resolvers import warm_up
+warm_up()
@@ -19,11 +19,37 @@ Why over AES-256-GCM (used by WhatsApp):
 
 import os
 import struct
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
-import nacl.secret
+import nacl.exceptions
 import nacl.utils
 
+# Primitive risolte una volta all'import. Nessun fallback: senza XChaCha20
+# (PyNaCl < 1.4) il modulo non si carica, invece di degradare a SecretBox.
+# Lo stream cifrato serve ai file a chunk: chiave e stato Poly1305
+# inizializzati una volta per file invece che per ogni chunk.
+try:
+    from nacl.bindings import (
+        crypto_aead_xchacha20poly1305_ietf_encrypt as _aead_encrypt_raw,
+        crypto_aead_xchacha20poly1305_ietf_decrypt as _aead_decrypt_raw,
+        crypto_secretstream_xchacha20poly1305_ABYTES as STREAM_ABYTES,
+        crypto_secretstream_xchacha20poly1305_HEADERBYTES as STREAM_HEADER_SIZE,
+        crypto_secretstream_xchacha20poly1305_TAG_FINAL as _TAG_FINAL,
+        crypto_secretstream_xchacha20poly1305_TAG_MESSAGE as _TAG_MESSAGE,
+        crypto_secretstream_xchacha20poly1305_init_pull as _stream_init_pull,
+        crypto_secretstream_xchacha20poly1305_init_push as _stream_init_push,
+        crypto_secretstream_xchacha20poly1305_pull as _stream_pull,
+        crypto_secretstream_xchacha20poly1305_push as _stream_push,
+        crypto_secretstream_xchacha20poly1305_state as _StreamState,
+    )
+except ImportError as exc:
+    raise ImportError('XChaCha20-Poly1305 not available: PyNaCl >= 1.4 required') from exc
+
+_rand = nacl.utils.random
+_U64 = struct.Struct('>Q')
+_II = struct.Struct('>II')
 
 # ══════════════════════════════════════════════════
 # CONSTANTS
@@ -34,12 +60,23 @@ KEY_SIZE = 32          # 256-bit key
 TAG_SIZE = 16          # Poly1305 authentication tag
 CHUNK_SIZE = 65536     # 64KB chunks for large files
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB max
+PARALLEL_MIN_CHUNKS = 4  # sotto questa soglia il pool costa più di quanto fa risparmiare
 
 
 # ══════════════════════════════════════════════════
 # XCHACHA20-POLY1305 AEAD (via libsodium)
 # ══════════════════════════════════════════════════
 
+def _check_key(key):
+    if len(key) != KEY_SIZE:
+        raise ValueError(f'Key must be {KEY_SIZE} bytes, got {len(key)}')
+
+
+def _as_bytes(value):
+    # str -> UTF-8; bytes e buffer passano invariati
+    return value.encode('utf-8') if type(value) is str else value
+
+
 def aead_encrypt(key, plaintext, associated_data=b''):
     """
     Encrypt with XChaCha20-Poly1305 AEAD using libsodium via PyNaCl.
@@ -56,41 +93,27 @@ def aead_encrypt(key, plaintext, associated_data=b''):
     collision probability after N messages is approximately N^2 / 2^192.
     Even after 2^80 messages (~10^24), collision chance is ~2^-32.
     """
-    if len(key) != KEY_SIZE:
-        raise ValueError(f'Key must be {KEY_SIZE} bytes, got {len(key)}')
-    if isinstance(plaintext, str):
-        plaintext = plaintext.encode('utf-8')
-    if isinstance(associated_data, str):
-        associated_data = associated_data.encode('utf-8')
-    
+    _check_key(key)
+    return _aead_encrypt_unchecked(key, _as_bytes(plaintext), _as_bytes(associated_data))
+
+
+def _aead_encrypt_unchecked(key, plaintext, associated_data):
+    # Senza validazione: il chiamante garantisce key di 32 byte e argomenti bytes
+    # (chiavi dal KDF del ratchet, header codificato come AAD)
     # Generate 24-byte random nonce (XChaCha20 extended nonce)
-    nonce = nacl.utils.random(NONCE_SIZE)
-    
-    # Create SecretBox-like encryption with AAD
-    # PyNaCl's SecretBox uses XSalsa20, but we use the lower-level
+    nonce = _rand(NONCE_SIZE)
+    return nonce + _aead_seal(key, plaintext, associated_data, nonce)
+
+
+def _aead_seal(key, plaintext, associated_data, nonce):
+    """
+    Ciphertext + tag senza il nonce davanti: chi compone un formato più ampio
+    (envelope, file) unisce nonce e ciphertext nello stesso join del resto,
+    evitando una copia intermedia grande quanto il ciphertext.
+    """
+    # PyNaCl's SecretBox uses XSalsa20 without AAD: we use the lower-level
     # nacl.bindings for XChaCha20-Poly1305 with AAD
-    try:
-        from nacl.bindings import (
-            crypto_aead_xchacha20poly1305_ietf_encrypt,
-            crypto_aead_xchacha20poly1305_ietf_decrypt,
-        )
-        ciphertext = crypto_aead_xchacha20poly1305_ietf_encrypt(
-            plaintext, associated_data, nonce, key
-        )
-    except ImportError:
-        # Fallback: use SecretBox (XSalsa20-Poly1305, also 24-byte nonce)
-        # Less ideal but still 24-byte nonce and battle-tested
-        box = nacl.secret.SecretBox(key)
-        # SecretBox doesn't support AAD natively, so we hash AAD into the plaintext
-        # Format: [32 bytes: SHA-256 of AAD] + [plaintext]
-        aad_hash = hashlib.sha256(associated_data).digest()
-        combined = aad_hash + plaintext
-        encrypted = box.encrypt(combined, nonce)
-        # encrypted = nonce + ciphertext (SecretBox prepends nonce)
-        # We want our own format: nonce + ciphertext
-        return nonce + encrypted.ciphertext
-    
-    return nonce + ciphertext
+    return _aead_encrypt_raw(plaintext, associated_data, nonce, key)
 
 
 def aead_decrypt(key, data, associated_data=b''):
@@ -99,7 +122,7 @@ def aead_decrypt(key, data, associated_data=b''):
     
     Args:
         key: 32-byte key
-        data: nonce (24) + ciphertext + tag
+        data: nonce (24) + ciphertext + tag (bytes or any buffer, e.g. memoryview)
         associated_data: must match encryption AAD
     
     Returns:
@@ -108,41 +131,34 @@ def aead_decrypt(key, data, associated_data=b''):
     Raises:
         nacl.exceptions.CryptoError: if authentication fails
     """
-    if len(key) != KEY_SIZE:
-        raise ValueError(f'Key must be {KEY_SIZE} bytes, got {len(key)}')
-    if isinstance(associated_data, str):
-        associated_data = associated_data.encode('utf-8')
+    _check_key(key)
+    return _aead_decrypt_unchecked(key, data, _as_bytes(associated_data))
+
+
+def _aead_decrypt_unchecked(key, data, associated_data):
+    # Come _aead_encrypt_unchecked per key e AAD; data arriva dalla rete e
+    # resta validato
     if len(data) < NONCE_SIZE + TAG_SIZE:
         raise ValueError('Data too short to contain nonce + tag')
     
-    nonce = data[:NONCE_SIZE]
-    ciphertext = data[NONCE_SIZE:]
-    
-    try:
-        from nacl.bindings import (
-            crypto_aead_xchacha20poly1305_ietf_encrypt,
-            crypto_aead_xchacha20poly1305_ietf_decrypt,
-        )
-        plaintext = crypto_aead_xchacha20poly1305_ietf_decrypt(
-            ciphertext, associated_data, nonce, key
-        )
-    except ImportError:
-        # Fallback: SecretBox
-        box = nacl.secret.SecretBox(key)
-        combined = box.decrypt(ciphertext, nonce)
-        # Verify AAD hash
-        aad_hash = hashlib.sha256(associated_data).digest()
-        if combined[:32] != aad_hash:
-            raise ValueError('AAD verification failed')
-        plaintext = combined[32:]
-    
-    return plaintext
+    # PyNaCl accetta solo bytes: da una memoryview si copia una volta sola, qui
+    # (per un input bytes, bytes() sulla slice non copia di nuovo)
+    nonce = bytes(data[:NONCE_SIZE])
+    ciphertext = bytes(data[NONCE_SIZE:])
+    return _aead_decrypt_raw(ciphertext, associated_data, nonce, key)
 
 
 # ══════════════════════════════════════════════════
 # ENVELOPE ENCRYPTION (Layer 4)
 # ══════════════════════════════════════════════════
 
+ENVELOPE_TS_SIZE = 8   # timestamp ms, anche prefisso del nonce (v2)
+
+
+def _envelope_aad(timestamp, associated_data, label=b'SCP_ENVELOPE_v2'):
+    return b''.join((label, timestamp, _as_bytes(associated_data)))
+
+
 def envelope_encrypt(plaintext, associated_data=b''):
     """
     Envelope encryption: unique ephemeral key per message.
@@ -153,18 +169,18 @@ def envelope_encrypt(plaintext, associated_data=b''):
     
     Returns:
         (ephemeral_key: 32 bytes, encrypted_data: bytes)
-        encrypted_data = timestamp (8 bytes) + nonce (24) + ciphertext + tag (16)
+        encrypted_data = nonce (24: timestamp 8 + random 16) + ciphertext + tag (16)
     """
-    ephemeral_key = nacl.utils.random(KEY_SIZE)
-    
-    # Add timestamp to AAD for replay protection
-    timestamp = struct.pack('>Q', int(time.time() * 1000))
-    full_aad = b'SCP_ENVELOPE_v1' + timestamp + (associated_data if isinstance(associated_data, bytes) else associated_data.encode('utf-8'))
+    ephemeral_key = _rand(KEY_SIZE)
     
-    encrypted_data = aead_encrypt(ephemeral_key, plaintext, full_aad)
+    # Timestamp in AAD for replay protection; travels as the nonce prefix,
+    # so the receiver can rebuild the AAD without a separate field.
+    # La chiave è nuova a ogni messaggio: 16 byte casuali bastano al nonce.
+    timestamp = _U64.pack(int(time.time() * 1000))
+    nonce = timestamp + _rand(NONCE_SIZE - ENVELOPE_TS_SIZE)
+    full_aad = _envelope_aad(timestamp, associated_data)
     
-    # Prepend timestamp so receiver can reconstruct AAD
-    return ephemeral_key, timestamp + encrypted_data
+    return ephemeral_key, nonce + _aead_seal(ephemeral_key, _as_bytes(plaintext), full_aad, nonce)
 
 
 def envelope_decrypt(ephemeral_key, encrypted_data_with_ts, associated_data=b'',
@@ -172,20 +188,32 @@ def envelope_decrypt(ephemeral_key, encrypted_data_with_ts, associated_data=b'',
     """
     Decrypt envelope-encrypted data.
     Rejects messages older than max_age_seconds (anti-replay).
+    
+    Also accepts the v1 layout (timestamp 8 + random nonce 24 + ciphertext),
+    which can only still be in flight within max_age_seconds.
     """
-    timestamp = encrypted_data_with_ts[:8]
-    encrypted_data = encrypted_data_with_ts[8:]
+    # Vista sul buffer: il ciphertext viene copiato solo dentro aead_decrypt
+    data = memoryview(encrypted_data_with_ts)
+    timestamp = bytes(data[:ENVELOPE_TS_SIZE])
     
     # Check age (anti-replay)
-    msg_time_ms = struct.unpack('>Q', timestamp)[0]
+    msg_time_ms = _U64.unpack(timestamp)[0]
     age_seconds = (time.time() * 1000 - msg_time_ms) / 1000
     if age_seconds > max_age_seconds:
         raise ValueError(f'Message too old ({age_seconds:.0f}s > {max_age_seconds}s)')
     if age_seconds < -300:  # 5 min clock skew tolerance
         raise ValueError('Message timestamp is in the future')
     
-    full_aad = b'SCP_ENVELOPE_v1' + timestamp + (associated_data if isinstance(associated_data, bytes) else associated_data.encode('utf-8'))
-    return aead_decrypt(ephemeral_key, encrypted_data, full_aad)
+    try:
+        return aead_decrypt(ephemeral_key, data, _envelope_aad(timestamp, associated_data))
+    except nacl.exceptions.CryptoError:
+        # v1: timestamp prefissato a un nonce casuale separato
+        if len(data) < ENVELOPE_TS_SIZE + NONCE_SIZE + TAG_SIZE:
+            raise
+        return aead_decrypt(
+            ephemeral_key, data[ENVELOPE_TS_SIZE:],
+            _envelope_aad(timestamp, associated_data, b'SCP_ENVELOPE_v1'),
+        )
 
 
 # ══════════════════════════════════════════════════
@@ -195,6 +223,9 @@ def envelope_decrypt(ephemeral_key, encrypted_data_with_ts, associated_data=b'',
 SCP_MAGIC = b'SCP1'
 SCP_VERSION = 1
 
+_U8 = struct.Struct('B')
+_U16 = struct.Struct('>H')
+
 def pack_message(header_bytes, encrypted_envelope_key, encrypted_payload):
     """
     Pack a complete SCP message for wire transmission.
@@ -205,10 +236,10 @@ def pack_message(header_bytes, encrypted_envelope_key, encrypted_payload):
     """
     parts = [
         SCP_MAGIC,
-        struct.pack('B', SCP_VERSION),
-        struct.pack('>H', len(header_bytes)),
+        _U8.pack(SCP_VERSION),
+        _U16.pack(len(header_bytes)),
         header_bytes,
-        struct.pack('>H', len(encrypted_envelope_key)),
+        _U16.pack(len(encrypted_envelope_key)),
         encrypted_envelope_key,
         encrypted_payload,
     ]
@@ -219,21 +250,24 @@ def unpack_message(data):
     """
     Unpack a received SCP message.
     Returns: (version, header_bytes, encrypted_envelope_key, encrypted_payload)
+    
+    The parts are slices of data: pass a memoryview to get zero-copy views,
+    which aead_decrypt/envelope_decrypt accept directly.
     """
     if data[:4] != SCP_MAGIC:
         raise ValueError('Not an SCP message (invalid magic bytes)')
     
-    version = struct.unpack('B', data[4:5])[0]
+    version, = _U8.unpack_from(data, 4)
     if version != SCP_VERSION:
         raise ValueError(f'Unsupported SCP version: {version}')
     
     offset = 5
-    header_len = struct.unpack('>H', data[offset:offset+2])[0]
+    header_len, = _U16.unpack_from(data, offset)
     offset += 2
     header_bytes = data[offset:offset+header_len]
     offset += header_len
     
-    eek_len = struct.unpack('>H', data[offset:offset+2])[0]
+    eek_len, = _U16.unpack_from(data, offset)
     offset += 2
     encrypted_envelope_key = data[offset:offset+eek_len]
     offset += eek_len
@@ -247,87 +281,179 @@ def unpack_message(data):
 # FILE/MEDIA ENCRYPTION
 # ══════════════════════════════════════════════════
 
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _file_pool():
+    """
+    Pool di thread per il lavoro sui chunk dei file, creato al primo uso (e
+    ricreato dopo un fork). libsodium e hashlib rilasciano il GIL, quindi i
+    thread lavorano davvero in parallelo. None con una sola CPU: il passaggio
+    tra thread costerebbe senza guadagno.
+    """
+    global _pool, _pool_pid
+    if (os.cpu_count() or 1) < 2:
+        return None
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(
+                    max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='scp-file',
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _file_ad(associated_data):
+    # Nei file l'AAD del chiamante conta solo se bytes (formato storico)
+    return associated_data if isinstance(associated_data, bytes) else b''
+
+
 def encrypt_file(file_data, associated_data=b''):
     """
     Encrypt a file/media attachment with integrity verification.
     
-    Small files (<=64KB): single AEAD encryption
-    Large files: 64KB chunks, each with own nonce and chunk index in AAD
+    Small files (<=64KB): single AEAD encryption (mode 0x00)
+    Large files: 64KB chunks in one XChaCha20-Poly1305 secretstream (mode 0x02),
+    chunk index in AAD, last chunk tagged FINAL (truncation is detected)
     SHA-256 hash of plaintext stored for post-decryption integrity check.
     
+    Format (mode 0x02):
+    [1B: 0x02][32B: file_hash][24B: stream header][chunk ciphertexts, each len+17]
+    
     Returns: (file_key: 32 bytes, encrypted_data: bytes)
     """
     if len(file_data) > MAX_FILE_SIZE:
         raise ValueError(f'File too large: {len(file_data)} bytes (max {MAX_FILE_SIZE})')
     
-    file_key = nacl.utils.random(KEY_SIZE)
+    file_key = _rand(KEY_SIZE)
     file_hash = hashlib.sha256(file_data).digest()
+    ad = _file_ad(associated_data)
     
     if len(file_data) <= CHUNK_SIZE:
         # Single encryption
-        aad = b'SCP_FILE_SINGLE_v1' + file_hash + (associated_data if isinstance(associated_data, bytes) else b'')
-        encrypted = aead_encrypt(file_key, file_data, aad)
-        return file_key, b'\x00' + file_hash + encrypted
+        aad = b''.join((b'SCP_FILE_SINGLE_v1', file_hash, ad))
+        nonce = _rand(NONCE_SIZE)
+        encrypted = _aead_seal(file_key, file_data, aad, nonce)
+        return file_key, b''.join((b'\x00', file_hash, nonce, encrypted))
     else:
-        # Chunked encryption
-        chunks = []
+        # Chunked encryption: un solo stato secretstream per tutto il file
         num_chunks = (len(file_data) + CHUNK_SIZE - 1) // CHUNK_SIZE
+        state = _StreamState()
+        header = _stream_init_push(state, file_key)
+        parts = [b'\x02', file_hash, header]
         
+        # Parte invariante dell'AAD calcolata una volta: per chunk solo (i, num_chunks)
+        aad_head = b'SCP_FILE_STREAM_v1' + file_hash
+        pack_ii = _II.pack
+        view = memoryview(file_data)
         for i in range(num_chunks):
-            start = i * CHUNK_SIZE
-            end = min(start + CHUNK_SIZE, len(file_data))
-            chunk = file_data[start:end]
-            
-            chunk_aad = (b'SCP_FILE_CHUNK_v1' + file_hash +
-                        struct.pack('>II', i, num_chunks) +
-                        (associated_data if isinstance(associated_data, bytes) else b''))
-            encrypted_chunk = aead_encrypt(file_key, chunk, chunk_aad)
-            chunks.append(encrypted_chunk)
-        
-        parts = [b'\x01', file_hash, struct.pack('>I', num_chunks)]
-        for ec in chunks:
-            parts.append(struct.pack('>I', len(ec)))
-            parts.append(ec)
+            chunk = bytes(view[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE])
+            chunk_aad = b''.join((aad_head, pack_ii(i, num_chunks), ad))
+            tag = _TAG_FINAL if i == num_chunks - 1 else _TAG_MESSAGE
+            parts.append(_stream_push(state, chunk, chunk_aad, tag))
         
         return file_key, b''.join(parts)
 
 
+def _decrypt_file_stream(file_key, file_hash, payload, ad):
+    """
+    Chunk del formato 0x02: ogni chunk cifrato è CHUNK_SIZE + 17 byte, l'ultimo
+    più corto. Lo stream è sequenziale; in parallelo gira solo lo SHA-256 del
+    chunk precedente mentre si decifra il successivo.
+    
+    Returns: (plaintext, sha256 digest del plaintext)
+    """
+    header = bytes(payload[:STREAM_HEADER_SIZE])
+    stream = payload[STREAM_HEADER_SIZE:]
+    if len(header) != STREAM_HEADER_SIZE or len(stream) <= STREAM_ABYTES:
+        raise ValueError('Encrypted file stream too short')
+    
+    sealed_chunk = CHUNK_SIZE + STREAM_ABYTES
+    num_chunks = (len(stream) + sealed_chunk - 1) // sealed_chunk
+    state = _StreamState()
+    _stream_init_pull(state, header, file_key)
+    
+    aad_head = b'SCP_FILE_STREAM_v1' + file_hash
+    pack_ii = _II.pack
+    hasher = hashlib.sha256()
+    pool = _file_pool() if num_chunks >= PARALLEL_MIN_CHUNKS else None
+    hashing = None
+    decrypted_chunks = []
+    for i in range(num_chunks):
+        chunk_aad = b''.join((aad_head, pack_ii(i, num_chunks), ad))
+        try:
+            chunk, tag = _stream_pull(state, bytes(stream[i * sealed_chunk:(i + 1) * sealed_chunk]), chunk_aad)
+        except RuntimeError:
+            # PyNaCl segnala il tag non valido come RuntimeError: stesso errore di aead_decrypt
+            raise nacl.exceptions.CryptoError('Decryption failed. Ciphertext failed verification')
+        if (tag == _TAG_FINAL) != (i == num_chunks - 1):
+            raise ValueError('Encrypted file stream truncated or reordered')
+        decrypted_chunks.append(chunk)
+        if pool is None:
+            hasher.update(chunk)
+        else:
+            # Un solo update in volo: l'ordine dei chunk nello hash è preservato
+            if hashing is not None:
+                hashing.result()
+            hashing = pool.submit(hasher.update, chunk)
+    
+    if hashing is not None:
+        hashing.result()
+    return b''.join(decrypted_chunks), hasher.digest()
+
+
 def decrypt_file(file_key, encrypted_file_data, associated_data=b''):
     """
     Decrypt a file and verify SHA-256 integrity.
+    Accepts mode 0x00 (single), 0x02 (secretstream) and legacy 0x01
+    (per-chunk AEAD with length prefixes).
     Raises ValueError if file was tampered with.
     """
-    mode = encrypted_file_data[0]
-    file_hash = encrypted_file_data[1:33]
-    payload = encrypted_file_data[33:]
+    # Vista sul buffer cifrato: il payload non viene copiato, si copia solo
+    # un chunk alla volta (PyNaCl accetta solo bytes)
+    data = memoryview(encrypted_file_data)
+    mode = data[0]
+    file_hash = bytes(data[1:33])
+    payload = data[33:]
+    ad = _file_ad(associated_data)
+    actual_hash = None
     
     if mode == 0:
         # Single file
-        aad = b'SCP_FILE_SINGLE_v1' + file_hash + (associated_data if isinstance(associated_data, bytes) else b'')
-        decrypted = aead_decrypt(file_key, payload, aad)
+        aad = b''.join((b'SCP_FILE_SINGLE_v1', file_hash, ad))
+        decrypted = aead_decrypt(file_key, bytes(payload), aad)
+    elif mode == 2:
+        decrypted, actual_hash = _decrypt_file_stream(file_key, file_hash, payload, ad)
     elif mode == 1:
-        # Chunked file
-        num_chunks = struct.unpack('>I', payload[:4])[0]
+        # Legacy chunked file
+        num_chunks = struct.unpack_from('>I', payload, 0)[0]
         offset = 4
-        decrypted_chunks = []
+        aad_head = b'SCP_FILE_CHUNK_v1' + file_hash
+        pack_ii = _II.pack
+        sealed_chunks = []
+        aads = []
         
         for i in range(num_chunks):
-            chunk_len = struct.unpack('>I', payload[offset:offset+4])[0]
+            chunk_len = struct.unpack_from('>I', payload, offset)[0]
             offset += 4
-            chunk_data = payload[offset:offset+chunk_len]
+            sealed_chunks.append(bytes(payload[offset:offset+chunk_len]))
             offset += chunk_len
-            
-            chunk_aad = (b'SCP_FILE_CHUNK_v1' + file_hash +
-                        struct.pack('>II', i, num_chunks) +
-                        (associated_data if isinstance(associated_data, bytes) else b''))
-            decrypted_chunks.append(aead_decrypt(file_key, chunk_data, chunk_aad))
+            aads.append(b''.join((aad_head, pack_ii(i, num_chunks), ad)))
         
+        # Chunk indipendenti (nonce propri): decifrati in parallelo sul pool
+        keys = [file_key] * num_chunks
+        pool = _file_pool() if num_chunks >= PARALLEL_MIN_CHUNKS else None
+        decrypted_chunks = (pool.map if pool else map)(aead_decrypt, keys, sealed_chunks, aads)
         decrypted = b''.join(decrypted_chunks)
     else:
         raise ValueError(f'Unknown file encryption mode: {mode}')
     
     # Verify integrity
-    actual_hash = hashlib.sha256(decrypted).digest()
+    if actual_hash is None:
+        actual_hash = hashlib.sha256(decrypted).digest()
     if actual_hash != file_hash:
         raise ValueError('File integrity check failed! Data may have been tampered with.')
     
@@ -18,9 +18,11 @@ Why our implementation is stronger than Signal:
 """
 
 import json
+import os
 import struct
+import threading
 import hmac as hmac_module
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from .scp_keys import (
     generate_x448_keypair,
     generate_identity_dh_keypair,
@@ -29,10 +31,35 @@ from .scp_keys import (
     perform_dh,
     hkdf_sha512,
 )
-from .cipher import aead_encrypt, aead_decrypt
+from .cipher import _aead_decrypt_unchecked, _aead_encrypt_unchecked
 
 
 MAX_SKIP = 1000  # Max messages we can skip in a single chain
+CHAIN_KDF_LABEL = b'SCP_CHAIN_MSG_v2'  # kdf_chain_key e _skip_messages: devono coincidere
+
+
+_keygen_pool = None
+_keygen_pool_pid = None
+_keygen_pool_lock = threading.Lock()
+
+
+def _keygen_executor():
+    """Thread unico per generare in anticipo le coppie DH del ratchet (ricreato dopo un fork)."""
+    global _keygen_pool, _keygen_pool_pid
+    if _keygen_pool_pid != os.getpid():
+        with _keygen_pool_lock:
+            if _keygen_pool_pid != os.getpid():
+                _keygen_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scp-keygen')
+                _keygen_pool_pid = os.getpid()
+    return _keygen_pool
+
+
+def _generate_ratchet_keypair(crypto_version):
+    """(private, public) per il DH ratchet: X25519 (v2) o X448 (v1)."""
+    if crypto_version == 2:
+        kp = generate_identity_dh_keypair_v2()
+        return kp['private_key'], kp['public_key']
+    return generate_identity_dh_keypair()
 
 
 class MessageHeader:
@@ -41,31 +68,56 @@ class MessageHeader:
     Contains the sender's current ratchet public key and message counters.
     The header is used as Associated Authenticated Data (AAD) during encryption,
     so any tampering with the header will cause decryption to fail.
+    On the wire (wire_bytes) the constant 'SCP_HDR_v1' prefix is omitted: it is
+    re-added locally, so the AAD and its integrity are unchanged.
     dh_public: 56 bytes (X448) for crypto_version=1, 32 bytes (X25519) for crypto_version=2.
     """
     
+    __slots__ = ('dh_public', 'previous_chain_length', 'message_number', '_encoded')
+    
+    _COUNTERS = struct.Struct('>II')
+    _PREFIX = b'SCP_HDR_v1'
+    
     def __init__(self, dh_public, previous_chain_length, message_number):
         self.dh_public = dh_public                        # 56 bytes X448 or 32 bytes X25519
         self.previous_chain_length = previous_chain_length  # int: msgs in previous sending chain
         self.message_number = message_number                # int: msg number in current chain
+        self._encoded = None                                # encode() memoizzato (header immutabile)
     
     def encode(self):
         """Serialize to bytes (used as AAD)"""
-        return (
-            b'SCP_HDR_v1' +
-            self.dh_public +
-            struct.pack('>II', self.previous_chain_length, self.message_number)
-        )
+        if self._encoded is None:
+            self._encoded = b''.join((
+                self._PREFIX,
+                self.dh_public,
+                self._COUNTERS.pack(self.previous_chain_length, self.message_number),
+            ))
+        return self._encoded
+    
+    def wire_bytes(self):
+        """Serialize for transmission: encode() without the constant prefix"""
+        return self.encode()[len(self._PREFIX):]
+    
+    @classmethod
+    def decode_wire(cls, data, dh_key_size=56):
+        """Deserialize the wire_bytes() form (dh_public + counters)."""
+        if len(data) < 8 + dh_key_size:
+            raise ValueError('Header too short')
+        return cls.decode(cls._PREFIX + bytes(data[:8 + dh_key_size]), dh_key_size)
     
     @classmethod
     def decode(cls, data, dh_key_size=56):
         """Deserialize from bytes. dh_key_size: 56 for X448 (v1), 32 for X25519 (v2)."""
         prefix = data[:10]  # 'SCP_HDR_v1'
-        if prefix != b'SCP_HDR_v1':
+        if prefix != cls._PREFIX:
             raise ValueError('Invalid header prefix')
-        dh_public = data[10:10 + dh_key_size]
-        pn, n = struct.unpack('>II', data[10 + dh_key_size:18 + dh_key_size])
-        return cls(dh_public, pn, n)
+        # bytes anche da una memoryview: dh_public finisce nelle primitive nacl
+        dh_public = bytes(data[10:10 + dh_key_size])
+        pn, n = cls._COUNTERS.unpack_from(data, 10 + dh_key_size)
+        header = cls(dh_public, pn, n)
+        # I byte ricevuti sono già la forma codificata: niente ricostruzione
+        header._encoded = bytes(data[:18 + dh_key_size])
+        return header
     
     def __repr__(self):
         return f'Header(pn={self.previous_chain_length}, n={self.message_number}, dh={self.dh_public[:8].hex()}...)'
@@ -94,12 +146,12 @@ def kdf_chain_key(chain_key):
     Input: current chain key
     Output: (next_chain_key, message_key) each 32 bytes
     
-    Uses HMAC-SHA512 with different constants for chain vs message key.
-    This ensures chain_key and message_key are cryptographically independent.
+    One HMAC-SHA512 call yields 64 bytes, split into the two keys: the halves
+    of a PRF output are independent, so chain_key and message_key remain
+    cryptographically independent. One-shot hmac.digest runs entirely in C.
     """
-    next_chain = hmac_module.new(chain_key, b'\x01SCP_CHAIN', hashlib.sha512).digest()[:32]
-    message_key = hmac_module.new(chain_key, b'\x02SCP_MSG', hashlib.sha512).digest()[:32]
-    return next_chain, message_key
+    derived = hmac_module.digest(chain_key, CHAIN_KDF_LABEL, 'sha512')
+    return derived[:32], derived[32:]
 
 
 class DoubleRatchet:
@@ -127,7 +179,23 @@ class DoubleRatchet:
         self.send_count = 0
         self.recv_count = 0
         self.previous_send_count = 0
+        # (ratchet pub raw bytes, message number) -> message key
         self.skipped_keys = {}
+        # Future della prossima coppia DH, generata in background (non serializzata)
+        self._next_keypair = None
+    
+    def _prefetch_keypair(self):
+        """Avvia la generazione della coppia DH per il prossimo passo del ratchet."""
+        self._next_keypair = _keygen_executor().submit(_generate_ratchet_keypair, self.crypto_version)
+    
+    def _take_keypair(self):
+        """Coppia DH già pronta se il prefetch è concluso, altrimenti generata ora."""
+        pending, self._next_keypair = self._next_keypair, None
+        if pending is not None:
+            if pending.done():
+                return pending.result()
+            pending.cancel()
+        return _generate_ratchet_keypair(self.crypto_version)
     
     @classmethod
     def init_sender(cls, shared_secret, receiver_ratchet_pub, crypto_version=2):
@@ -147,12 +215,7 @@ class DoubleRatchet:
         state.receiving_ratchet_pub = receiver_ratchet_pub
 
         # Generate our first ratchet keypair (version-aware)
-        if crypto_version == 2:
-            kp = generate_identity_dh_keypair_v2()
-            state.sending_ratchet_priv = kp['private_key']
-            state.sending_ratchet_pub = kp['public_key']
-        else:
-            state.sending_ratchet_priv, state.sending_ratchet_pub = generate_identity_dh_keypair()
+        state.sending_ratchet_priv, state.sending_ratchet_pub = _generate_ratchet_keypair(crypto_version)
         
         # Derive initial root key from shared secret
         root_key = shared_secret[:32]
@@ -164,6 +227,7 @@ class DoubleRatchet:
         state.send_count = 0
         state.recv_count = 0
         state.previous_send_count = 0
+        state._prefetch_keypair()
         
         return state
     
@@ -189,6 +253,7 @@ class DoubleRatchet:
         state.send_count = 0
         state.recv_count = 0
         state.previous_send_count = 0
+        state._prefetch_keypair()
         return state
     
     def encrypt(self, plaintext):
@@ -216,7 +281,7 @@ class DoubleRatchet:
         self.send_count += 1
         
         # Encrypt plaintext with message key, header as AAD
-        ciphertext = aead_encrypt(message_key, plaintext, header.encode())
+        ciphertext = _aead_encrypt_unchecked(message_key, plaintext, header.encode())
         
         # Zero the message key from memory (best effort)
         del message_key
@@ -231,10 +296,10 @@ class DoubleRatchet:
         Returns: plaintext bytes
         """
         # 1. Check skipped keys first (out-of-order message)
-        skip_key = (header.dh_public.hex(), header.message_number)
+        skip_key = (header.dh_public, header.message_number)
         if skip_key in self.skipped_keys:
             message_key = self.skipped_keys.pop(skip_key)
-            plaintext = aead_decrypt(message_key, ciphertext, header.encode())
+            plaintext = _aead_decrypt_unchecked(message_key, ciphertext, header.encode())
             del message_key
             return plaintext
         
@@ -253,7 +318,7 @@ class DoubleRatchet:
         self.recv_count += 1
         
         # 5. Decrypt
-        plaintext = aead_decrypt(message_key, ciphertext, header.encode())
+        plaintext = _aead_decrypt_unchecked(message_key, ciphertext, header.encode())
         del message_key
         
         return plaintext
@@ -272,17 +337,13 @@ class DoubleRatchet:
         dh_recv = perform_dh(self.crypto_version, self.sending_ratchet_priv, self.receiving_ratchet_pub)
         self.root_key, self.receiving_chain_key = kdf_root_key(self.root_key, dh_recv)
         
-        # Generate new sending ratchet keypair (version-aware)
-        if self.crypto_version == 2:
-            kp = generate_identity_dh_keypair_v2()
-            self.sending_ratchet_priv = kp['private_key']
-            self.sending_ratchet_pub = kp['public_key']
-        else:
-            self.sending_ratchet_priv, self.sending_ratchet_pub = generate_identity_dh_keypair()
+        # New sending ratchet keypair (version-aware), usually prefetched in background
+        self.sending_ratchet_priv, self.sending_ratchet_pub = self._take_keypair()
         
         # Derive sending chain key
         dh_send = perform_dh(self.crypto_version, self.sending_ratchet_priv, self.receiving_ratchet_pub)
         self.root_key, self.sending_chain_key = kdf_root_key(self.root_key, dh_send)
+        self._prefetch_keypair()
     
     def _skip_messages(self, until):
         """
@@ -298,11 +359,30 @@ class DoubleRatchet:
                 'Possible attack or severely out-of-order delivery.'
             )
         
-        while self.recv_count < until:
-            self.receiving_chain_key, mk = kdf_chain_key(self.receiving_chain_key)
-            skip_key = (self.receiving_ratchet_pub.hex(), self.recv_count)
-            self.skipped_keys[skip_key] = mk
-            self.recv_count += 1
+        # Stesso passo di kdf_chain_key (stessa CHAIN_KDF_LABEL), con lookup e
+        # attributi tenuti in locali per tutto il ciclo
+        digest = hmac_module.digest
+        label = CHAIN_KDF_LABEL
+        ck = self.receiving_chain_key
+        pub = self.receiving_ratchet_pub
+        skipped = self.skipped_keys
+        for n in range(self.recv_count, until):
+            derived = digest(ck, label, 'sha512')
+            ck = derived[:32]
+            skipped[(pub, n)] = derived[32:]
+        self.receiving_chain_key = ck
+        self.recv_count = max(self.recv_count, until)
+    
+    # Formato binario v2: [B v=2][B crypto_version][I sc][I rc][I psc], poi i sei
+    # campi chiave come [B len][bytes] (len 0 = None), poi [I n] voci skipped
+    # [pub][I msg_num][32B mk] con pub di dimensione fissa per crypto_version
+    _SERIAL_V2 = 2
+    _HDR = struct.Struct('>BBIII')
+    _U32 = struct.Struct('>I')
+    _KEY_FIELDS = (
+        'root_key', 'sending_chain_key', 'receiving_chain_key',
+        'sending_ratchet_priv', 'sending_ratchet_pub', 'receiving_ratchet_pub',
+    )
     
     def serialize(self):
         """
@@ -311,25 +391,61 @@ class DoubleRatchet:
         WARNING: This contains sensitive key material.
         The output MUST be encrypted before storing (e.g., with device keychain).
         """
-        state = {
-            'v': 1,  # serialization version
-            'crypto_version': self.crypto_version,
-            'rk': self.root_key.hex() if self.root_key else None,
-            'sck': self.sending_chain_key.hex() if self.sending_chain_key else None,
-            'rck': self.receiving_chain_key.hex() if self.receiving_chain_key else None,
-            'srp': self.sending_ratchet_priv.hex() if self.sending_ratchet_priv else None,
-            'sru': self.sending_ratchet_pub.hex() if self.sending_ratchet_pub else None,
-            'rrp': self.receiving_ratchet_pub.hex() if self.receiving_ratchet_pub else None,
-            'sc': self.send_count,
-            'rc': self.recv_count,
-            'psc': self.previous_send_count,
-            'sk': {f'{k[0]}:{k[1]}': v.hex() for k, v in self.skipped_keys.items()},
-        }
-        return json.dumps(state, separators=(',', ':')).encode('utf-8')
+        parts = [self._HDR.pack(
+            self._SERIAL_V2, self.crypto_version,
+            self.send_count, self.recv_count, self.previous_send_count,
+        )]
+        for name in self._KEY_FIELDS:
+            value = getattr(self, name) or b''
+            parts.append(bytes((len(value),)))
+            parts.append(value)
+        parts.append(self._U32.pack(len(self.skipped_keys)))
+        pack_n = self._U32.pack
+        parts.extend(
+            pub + pack_n(n) + mk
+            for (pub, n), mk in self.skipped_keys.items()
+        )
+        return b''.join(parts)
     
     @classmethod
     def deserialize(cls, data):
-        """Restore ratchet state from serialized bytes."""
+        """Restore ratchet state from serialized bytes (binary v2 or legacy JSON v1)."""
+        if data[:1] == b'{':
+            return cls._deserialize_json(data)
+        
+        version, crypto_version, sc, rc, psc = cls._HDR.unpack_from(data, 0)
+        if version != cls._SERIAL_V2:
+            raise ValueError(f'Unsupported ratchet serialization version: {version}')
+        
+        state = cls(crypto_version=crypto_version)
+        state.send_count = sc
+        state.recv_count = rc
+        state.previous_send_count = psc
+        
+        offset = cls._HDR.size
+        for name in cls._KEY_FIELDS:
+            size = data[offset]
+            offset += 1
+            setattr(state, name, bytes(data[offset:offset + size]) if size else None)
+            offset += size
+        
+        (count,) = cls._U32.unpack_from(data, offset)
+        offset += 4
+        pub_size = 32 if crypto_version == 2 else 56
+        entry_size = pub_size + 4 + 32
+        if len(data) - offset != count * entry_size:
+            raise ValueError('Corrupted ratchet state: skipped keys table size mismatch')
+        unpack_n = cls._U32.unpack_from
+        for _ in range(count):
+            pub = bytes(data[offset:offset + pub_size])
+            (n,) = unpack_n(data, offset + pub_size)
+            state.skipped_keys[(pub, n)] = bytes(data[offset + pub_size + 4:offset + entry_size])
+            offset += entry_size
+        return state
+    
+    @classmethod
+    def _deserialize_json(cls, data):
+        """Legacy JSON v1 format (hex-encoded keys)."""
         state_dict = json.loads(data.decode('utf-8'))
         
         if state_dict.get('v', 0) != 1:
@@ -348,5 +464,5 @@ class DoubleRatchet:
         state.skipped_keys = {}
         for k, v in state_dict['sk'].items():
             pub_hex, num = k.rsplit(':', 1)
-            state.skipped_keys[(pub_hex, int(num))] = bytes.fromhex(v)
+            state.skipped_keys[(bytes.fromhex(pub_hex), int(num))] = bytes.fromhex(v)
         return state
@@ -0,0 +1,146 @@
+"""Tests for SCP file encryption (cipher.encrypt_file / decrypt_file)."""
+import hashlib
+import os
+import struct
+import time
+from unittest import mock
+
+import nacl.exceptions
+from django.test import TestCase
+
+from encryption import cipher
+from encryption.cipher import CHUNK_SIZE, decrypt_file, encrypt_file
+
+
+class FileCipherTestCase(TestCase):
+    """Test chunked file encryption."""
+
+    def test_small_file_roundtrip(self):
+        data = os.urandom(1000)
+        key, encrypted = encrypt_file(data, b'ad')
+        self.assertEqual(encrypted[0], 0)
+        self.assertEqual(decrypt_file(key, encrypted, b'ad'), data)
+
+    def test_chunked_file_roundtrip(self):
+        """Large files use the secretstream format (mode 0x02)."""
+        for size in (CHUNK_SIZE + 1, 2 * CHUNK_SIZE, 3 * CHUNK_SIZE + 5):
+            data = os.urandom(size)
+            key, encrypted = encrypt_file(data, b'ad')
+            self.assertEqual(encrypted[0], 2)
+            self.assertEqual(decrypt_file(key, encrypted, b'ad'), data)
+
+    def _legacy_encrypt(self, data, key):
+        """Per-chunk AEAD format (mode 0x01) as written by older clients."""
+        num_chunks = (len(data) + CHUNK_SIZE - 1) // CHUNK_SIZE
+        file_hash = hashlib.sha256(data).digest()
+        parts = [b'\x01', file_hash, struct.pack('>I', num_chunks)]
+        for i in range(num_chunks):
+            aad = b'SCP_FILE_CHUNK_v1' + file_hash + struct.pack('>II', i, num_chunks)
+            ec = cipher.aead_encrypt(key, data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE], aad)
+            parts += [struct.pack('>I', len(ec)), ec]
+        return b''.join(parts)
+
+    def test_legacy_chunked_format_decrypts(self):
+        """Files encrypted with the per-chunk AEAD format (mode 0x01) still decrypt."""
+        data = os.urandom(2 * CHUNK_SIZE + 10)
+        key = os.urandom(cipher.KEY_SIZE)
+        self.assertEqual(decrypt_file(key, self._legacy_encrypt(data, key)), data)
+
+    def test_parallel_decrypt(self):
+        """With several CPUs large files are decrypted using the chunk thread pool."""
+        data = os.urandom(cipher.PARALLEL_MIN_CHUNKS * CHUNK_SIZE + 1)
+        legacy_key = os.urandom(cipher.KEY_SIZE)
+        legacy = self._legacy_encrypt(data, legacy_key)
+        key, encrypted = encrypt_file(data)
+        with mock.patch('os.cpu_count', return_value=4):
+            self.assertEqual(decrypt_file(legacy_key, legacy), data)
+            self.assertEqual(decrypt_file(key, encrypted), data)
+            tampered = bytearray(legacy)
+            tampered[-1] ^= 1
+            with self.assertRaises(nacl.exceptions.CryptoError):
+                decrypt_file(legacy_key, bytes(tampered))
+
+    def test_truncated_stream_fails(self):
+        data = os.urandom(3 * CHUNK_SIZE)
+        key, encrypted = encrypt_file(data)
+        sealed = CHUNK_SIZE + cipher.STREAM_ABYTES
+        first_chunk_only = encrypted[:33 + cipher.STREAM_HEADER_SIZE + sealed]
+        with self.assertRaises(nacl.exceptions.CryptoError):
+            decrypt_file(key, first_chunk_only)
+        with self.assertRaises(nacl.exceptions.CryptoError):
+            decrypt_file(key, encrypted[:-1])
+
+    def test_wrong_associated_data_fails(self):
+        key, encrypted = encrypt_file(os.urandom(2 * CHUNK_SIZE), b'ad')
+        with self.assertRaises(nacl.exceptions.CryptoError):
+            decrypt_file(key, encrypted, b'other')
+
+
+class AeadTestCase(TestCase):
+    """Test the XChaCha20-Poly1305 AEAD primitive."""
+
+    def test_str_and_bytes_aad_are_equivalent(self):
+        key = os.urandom(cipher.KEY_SIZE)
+        data = cipher.aead_encrypt(key, 'ciao', 'ad')
+        self.assertEqual(cipher.aead_decrypt(key, data, b'ad'), b'ciao')
+
+    def test_wrong_key_length(self):
+        with self.assertRaises(ValueError):
+            cipher.aead_encrypt(b'short', b'x')
+        with self.assertRaises(ValueError):
+            cipher.aead_decrypt(b'short', b'x' * 64)
+
+    def test_wrong_aad_rejected(self):
+        key = os.urandom(cipher.KEY_SIZE)
+        data = cipher.aead_encrypt(key, b'payload', b'ad')
+        self.assertEqual(cipher.aead_decrypt(key, data, b'ad'), b'payload')
+        with self.assertRaises(nacl.exceptions.CryptoError):
+            cipher.aead_decrypt(key, data, b'other')
+
+
+class EnvelopeTestCase(TestCase):
+    """Test the envelope wire format (timestamp as nonce prefix)."""
+
+    def test_timestamp_is_nonce_prefix(self):
+        key, blob = cipher.envelope_encrypt(b'payload', b'ad')
+        self.assertEqual(len(blob), cipher.NONCE_SIZE + len(b'payload') + cipher.TAG_SIZE)
+        ts = struct.unpack('>Q', blob[:8])[0]
+        self.assertLess(abs(ts / 1000 - time.time()), 5)
+        self.assertEqual(cipher.envelope_decrypt(key, blob, b'ad'), b'payload')
+
+    def test_v1_envelope_still_decrypts(self):
+        key = os.urandom(cipher.KEY_SIZE)
+        ts = struct.pack('>Q', int(time.time() * 1000))
+        blob = ts + cipher.aead_encrypt(key, b'payload', b'SCP_ENVELOPE_v1' + ts + b'ad')
+        self.assertEqual(cipher.envelope_decrypt(key, blob, b'ad'), b'payload')
+        with self.assertRaises(nacl.exceptions.CryptoError):
+            cipher.envelope_decrypt(key, blob, b'other')
+
+    def test_old_envelope_rejected(self):
+        with mock.patch.object(cipher.time, 'time', return_value=time.time() - 2 * 86400):
+            key, blob = cipher.envelope_encrypt(b'payload')
+        with self.assertRaises(ValueError):
+            cipher.envelope_decrypt(key, blob)
+
+
+class MessageWireFormatTestCase(TestCase):
+    """Test SCP message packing."""
+
+    def test_pack_unpack_roundtrip(self):
+        packed = cipher.pack_message(b'h' * 60, b'e' * 72, b'p' * 200)
+        self.assertEqual(packed[:4], cipher.SCP_MAGIC)
+        self.assertEqual(cipher.unpack_message(packed), (1, b'h' * 60, b'e' * 72, b'p' * 200))
+
+    def test_invalid_magic_and_version(self):
+        packed = cipher.pack_message(b'h', b'e', b'p')
+        with self.assertRaises(ValueError):
+            cipher.unpack_message(b'XXXX' + packed[4:])
+        with self.assertRaises(ValueError):
+            cipher.unpack_message(packed[:4] + b'\x02' + packed[5:])
+
+    def test_envelope_decrypt_from_memoryview(self):
+        key, blob = cipher.envelope_encrypt(b'payload', associated_data=b'ad')
+        packed = cipher.pack_message(b'h' * 60, b'e' * 72, blob)
+        _, _, _, payload = cipher.unpack_message(memoryview(packed))
+        self.assertIsInstance(payload, memoryview)
+        self.assertEqual(cipher.envelope_decrypt(key, payload, associated_data=b'ad'), b'payload')
@@ -0,0 +1,159 @@
+"""Tests for DoubleRatchet state serialization and message headers."""
+import json
+import os
+
+from django.test import TestCase
+
+from encryption.cipher import pack_message, unpack_message
+from encryption.double_ratchet import MAX_SKIP, DoubleRatchet, MessageHeader
+from encryption.scp_keys import generate_identity_dh_keypair, generate_identity_dh_keypair_v2
+
+
+def _session_pair(crypto_version):
+    if crypto_version == 2:
+        kp = generate_identity_dh_keypair_v2()
+        priv, pub = kp['private_key'], kp['public_key']
+    else:
+        priv, pub = generate_identity_dh_keypair()
+    secret = os.urandom(32 if crypto_version == 2 else 64)
+    alice = DoubleRatchet.init_sender(secret, pub, crypto_version=crypto_version)
+    bob = DoubleRatchet.init_receiver(secret, priv, pub, crypto_version=crypto_version)
+    return alice, bob
+
+
+def _legacy_json(ratchet):
+    """Stato nel vecchio formato JSON v1 (chiavi hex)."""
+    def h(value):
+        return value.hex() if value else None
+    return json.dumps({
+        'v': 1,
+        'crypto_version': ratchet.crypto_version,
+        'rk': h(ratchet.root_key),
+        'sck': h(ratchet.sending_chain_key),
+        'rck': h(ratchet.receiving_chain_key),
+        'srp': h(ratchet.sending_ratchet_priv),
+        'sru': h(ratchet.sending_ratchet_pub),
+        'rrp': h(ratchet.receiving_ratchet_pub),
+        'sc': ratchet.send_count,
+        'rc': ratchet.recv_count,
+        'psc': ratchet.previous_send_count,
+        'sk': {f'{k[0].hex()}:{k[1]}': v.hex() for k, v in ratchet.skipped_keys.items()},
+    }, separators=(',', ':')).encode('utf-8')
+
+
+class DoubleRatchetSerializationTestCase(TestCase):
+    """Binary (v2) and legacy JSON (v1) ratchet state."""
+
+    def _exchange_with_skipped(self, crypto_version):
+        alice, bob = _session_pair(crypto_version)
+        sent = [alice.encrypt(f'msg {i}'.encode()) for i in range(4)]
+        # Bob riceve solo l'ultimo: i primi tre restano nelle skipped keys
+        self.assertEqual(bob.decrypt(*sent[3]), b'msg 3')
+        self.assertEqual(len(bob.skipped_keys), 3)
+        return alice, bob, sent
+
+    def test_binary_roundtrip_keeps_skipped_keys(self):
+        for crypto_version in (1, 2):
+            alice, bob, sent = self._exchange_with_skipped(crypto_version)
+            data = bob.serialize()
+            self.assertEqual(data[0], 2)
+            bob2 = DoubleRatchet.deserialize(data)
+            self.assertEqual(bob2.skipped_keys, bob.skipped_keys)
+            self.assertEqual(bob2.decrypt(*sent[1]), b'msg 1')
+            # Il ratchet continua dopo il restore
+            header, ct = DoubleRatchet.deserialize(bob2.serialize()).encrypt(b'reply')
+            self.assertEqual(alice.decrypt(header, ct), b'reply')
+
+    def test_sender_without_receiving_chain(self):
+        alice, _ = _session_pair(2)
+        alice2 = DoubleRatchet.deserialize(alice.serialize())
+        self.assertIsNone(alice2.receiving_chain_key)
+        self.assertEqual(alice2.sending_chain_key, alice.sending_chain_key)
+
+    def test_legacy_json_state_still_loads(self):
+        _, bob, sent = self._exchange_with_skipped(2)
+        bob2 = DoubleRatchet.deserialize(_legacy_json(bob))
+        self.assertEqual(bob2.decrypt(*sent[0]), b'msg 0')
+        self.assertEqual(bob2.recv_count, bob.recv_count)
+
+    def test_binary_is_smaller_than_json(self):
+        _, bob, _ = self._exchange_with_skipped(2)
+        self.assertLess(len(bob.serialize()), len(_legacy_json(bob)) // 2)
+
+    def test_truncated_state_rejected(self):
+        _, bob, _ = self._exchange_with_skipped(2)
+        with self.assertRaises(ValueError):
+            DoubleRatchet.deserialize(bob.serialize()[:-1])
+
+
+class DoubleRatchetSkipTestCase(TestCase):
+    """Skipped message keys for out-of-order delivery."""
+
+    def test_skipped_keys_follow_chain_kdf(self):
+        alice, bob = _session_pair(2)
+        sent = [alice.encrypt(f'msg {i}'.encode()) for i in range(6)]
+        self.assertEqual(bob.decrypt(*sent[5]), b'msg 5')
+        self.assertEqual(bob.recv_count, 6)
+        # Messaggi arretrati in ordine sparso: ogni skipped key si usa una volta
+        for i in (2, 0, 4, 1, 3):
+            self.assertEqual(bob.decrypt(*sent[i]), f'msg {i}'.encode())
+        self.assertEqual(bob.skipped_keys, {})
+
+    def test_skip_beyond_max_rejected(self):
+        alice, bob = _session_pair(2)
+        self.assertEqual(bob.decrypt(*alice.encrypt(b'first')), b'first')
+        with self.assertRaises(ValueError):
+            bob._skip_messages(bob.recv_count + MAX_SKIP + 1)
+
+
+class MessageHeaderWireTestCase(TestCase):
+    """Header wire form without the constant prefix."""
+
+    def test_wire_form_decrypts(self):
+        for crypto_version, dh_size in ((1, 56), (2, 32)):
+            alice, bob = _session_pair(crypto_version)
+            header, ciphertext = alice.encrypt(b'hello')
+            wire = header.wire_bytes()
+            self.assertEqual(len(wire), dh_size + 8)
+            self.assertEqual(len(header.encode()) - len(wire), 10)
+            received = MessageHeader.decode_wire(wire, dh_key_size=dh_size)
+            self.assertEqual(received.encode(), header.encode())
+            self.assertEqual(bob.decrypt(received, ciphertext), b'hello')
+
+    def test_decode_from_memoryview_survives_ratchet_step(self):
+        alice, bob = _session_pair(2)
+        self.assertEqual(bob.decrypt(*alice.encrypt(b'ping')), b'ping')
+        # Risposta di bob: alice riceve una nuova chiave di ratchet (passo DH)
+        header, ciphertext = bob.encrypt(b'pong')
+        frame = pack_message(header.encode(), b'', ciphertext)
+        _, header_bytes, _, payload = unpack_message(memoryview(frame))
+        received = MessageHeader.decode(header_bytes, dh_key_size=32)
+        self.assertIs(type(received.dh_public), bytes)
+        self.assertEqual(alice.decrypt(received, payload), b'pong')
+        self.assertEqual(bob.decrypt(*alice.encrypt(b'again')), b'again')
+
+    def test_short_wire_form_rejected(self):
+        with self.assertRaises(ValueError):
+            MessageHeader.decode_wire(b'\x00' * 39, dh_key_size=32)
+
+
+class DoubleRatchetKeypairPrefetchTestCase(TestCase):
+    """The next DH ratchet keypair is generated in background."""
+
+    def test_ratchet_step_uses_prefetched_keypair(self):
+        alice, bob = _session_pair(2)
+        prefetched_priv, prefetched_pub = bob._next_keypair.result(timeout=5)
+        header, ct = alice.encrypt(b'hello')
+        self.assertEqual(bob.decrypt(header, ct), b'hello')
+        self.assertEqual(bob.sending_ratchet_pub, prefetched_pub)
+        self.assertEqual(bob.sending_ratchet_priv, prefetched_priv)
+        # Dopo il passo ne è già in preparazione un'altra
+        self.assertIsNotNone(bob._next_keypair)
+
+    def test_conversation_continues_across_ratchet_steps(self):
+        alice, bob = _session_pair(1)
+        for i in range(3):
+            header, ct = alice.encrypt(f'a{i}'.encode())
+            self.assertEqual(bob.decrypt(header, ct), f'a{i}'.encode())
+            header, ct = bob.encrypt(f'b{i}'.encode())
+            self.assertEqual(alice.decrypt(header, ct), f'b{i}'.encode())
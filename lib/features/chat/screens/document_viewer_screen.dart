@@ -109,10 +109,19 @@ class _DocumentViewerScreenState extends State<DocumentViewerScreen> {
     debugPrint('📄 Convert URL: $url');
     debugPrint('📄 Token present: ${token != null}');
 
-    final response = await http.get(
+    // 202: conversione in corso sul server, riprova finché il PDF è pronto
+    var response = await http.get(
       Uri.parse(url),
       headers: token != null ? {'Authorization': 'Bearer $token'} : {},
     );
+    for (var attempt = 0; response.statusCode == 202 && attempt < 60; attempt++) {
+      final retryAfter = int.tryParse(response.headers['retry-after'] ?? '') ?? 2;
+      await Future.delayed(Duration(seconds: retryAfter));
+      response = await http.get(
+        Uri.parse(url),
+        headers: token != null ? {'Authorization': 'Bearer $token'} : {},
+      );
+    }
 
     if (response.statusCode != 200) {
       throw Exception('Conversione fallita: ${response.statusCode}');